@@ -0,0 +1,151 @@
+"""
+Id generators of primary keys and public ids.
+
+Random (v4) UUIDs land anywhere in a B-tree index, so every insert touches a
+random leaf page. Time-ordered ids (UUIDv7, ULID) are appended at the right edge
+of the index instead, which keeps the hot pages in cache as the table grows.
+Ids are monotonic within a process: ids created in the same millisecond still
+sort in creation order.
+"""
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Type
+
+from config import Config
+
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+class IdGenerator(ABC):
+    """
+    Interface of the id generators: 128-bit ids, as UUIDs or as strings.
+    """
+
+    @abstractmethod
+    def new_int(self) -> int:
+        ...
+
+    def batch_ints(self, count: int) -> List[int]:
+        return [self.new_int() for _ in range(count)]
+
+    def new(self) -> uuid.UUID:
+        return uuid.UUID(int=self.new_int())
+
+    def batch(self, count: int) -> List[uuid.UUID]:
+        """
+        `count` ids at once, e.g. for a bulk insert.
+        """
+        return [uuid.UUID(int=value) for value in self.batch_ints(count)]
+
+    def to_str(self, value: int) -> str:
+        return f"{value:032X}"
+
+    def new_str(self) -> str:
+        return self.to_str(self.new_int())
+
+
+class UUID4Generator(IdGenerator):
+    """
+    Random ids, not ordered.
+    """
+
+    def new_int(self) -> int:
+        return uuid.uuid4().int
+
+
+class TimeOrderedGenerator(IdGenerator):
+    """
+    Millisecond timestamp in the top 48 bits followed by `counter_bits` of a counter
+    and `random_bits` of randomness. The counter starts at a random value in the
+    lower half of its range every millisecond and is incremented for each id of the
+    same millisecond; when it overflows the timestamp is moved forward by one.
+    """
+    counter_bits = 0
+    random_bits = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._counter = 0
+
+    @abstractmethod
+    def _layout(self, timestamp_ms: int, counter: int, random_value: int) -> int:
+        ...
+
+    def _next(self, random_value: int) -> int:
+        # Called with the lock held.
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > self._last_ms:
+            self._last_ms = now_ms
+            # Random start, with headroom for the ids of the same millisecond.
+            self._counter = (random_value >> self.random_bits) & ((1 << (self.counter_bits - 1)) - 1)
+        else:
+            # Same millisecond, or the clock went back: keep counting from the last id.
+            self._counter += 1
+            if self._counter >> self.counter_bits:
+                self._last_ms += 1
+                self._counter = 0
+        return self._layout(self._last_ms, self._counter, random_value & ((1 << self.random_bits) - 1))
+
+    def new_int(self) -> int:
+        random_value = int.from_bytes(os.urandom(16), "big")
+        with self._lock:
+            return self._next(random_value)
+
+    def batch_ints(self, count: int) -> List[int]:
+        # One read of the random source and one lock for the whole batch.
+        random_bytes = os.urandom(16 * count)
+        with self._lock:
+            return [
+                self._next(int.from_bytes(random_bytes[index:index + 16], "big"))
+                for index in range(0, 16 * count, 16)
+            ]
+
+
+class UUID7Generator(TimeOrderedGenerator):
+    """
+    UUIDv7 (RFC 9562): 48-bit timestamp, version, 12-bit counter (`rand_a`),
+    variant and 62 random bits (`rand_b`).
+    """
+    counter_bits = 12
+    random_bits = 62
+
+    def _layout(self, timestamp_ms: int, counter: int, random_value: int) -> int:
+        return (timestamp_ms & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | counter << 64 | 0x2 << 62 | random_value
+
+
+class ULIDGenerator(TimeOrderedGenerator):
+    """
+    Monotonic ULID: 48-bit timestamp and 80 random bits, incremented for the ids of
+    the same millisecond. Written as 26 Crockford base32 characters, which sort like the ids.
+    """
+    counter_bits = 80
+    random_bits = 0
+
+    def _layout(self, timestamp_ms: int, counter: int, random_value: int) -> int:
+        return (timestamp_ms & 0xFFFFFFFFFFFF) << 80 | counter
+
+    def to_str(self, value: int) -> str:
+        return "".join(CROCKFORD_ALPHABET[(value >> shift) & 0x1F] for shift in range(125, -1, -5))
+
+
+ID_GENERATORS: Dict[str, Type[IdGenerator]] = {
+    "uuid4": UUID4Generator,
+    "uuid7": UUID7Generator,
+    "ulid": ULIDGenerator,
+}
+
+
+def get_id_generator(name: str) -> IdGenerator:
+    if name not in ID_GENERATORS:
+        raise RuntimeError(f"Improper id generator '{name}'.")
+    return ID_GENERATORS[name]()
+
+
+# Primary keys of `BaseModel` and public item ids
+pk_generator = get_id_generator(Config.ID_GENERATOR)
+item_id_generator = get_id_generator(Config.ITEM_ID_GENERATOR)
@@ -0,0 +1,343 @@
+"""
+Prometheus metrics of the app, rendered in the text exposition format at `/metrics`.
+
+Recording is lock-free: each worker process keeps its own values in plain dicts,
+only touched from the event loop thread. With several workers each one dumps its
+values into `Config.METRICS_MULTIPROC_DIR` and `/metrics` adds them all up.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import time
+import weakref
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self, values: Optional[dict] = None):
+        ...
+
+    def _labels(self, key: tuple, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self, values: Optional[dict] = None):
+        for key, value in (values if values is not None else self.values).items():
+            yield f"{self.name}{self._labels(key)} {value}"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[tuple, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        # Called at render time instead of keeping the value up to date.
+        self.collect = collect
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        self.values[self._key(labels)] = value
+
+    def current(self) -> dict:
+        if self.collect is not None:
+            return self.collect()
+        return self.values
+
+    def samples(self, values: Optional[dict] = None):
+        for key, value in (values if values is not None else self.current()).items():
+            yield f"{self.name}{self._labels(key)} {value}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # Per-bucket (non cumulative) counts, the last one is +Inf, then the sum.
+            state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def samples(self, values: Optional[dict] = None):
+        for key, state in (values if values is not None else self.values).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{self._labels(key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {state[-1]}"
+            yield f"{self.name}_count{self._labels(key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "metrics": {
+                name: [[list(key), value] for key, value in
+                       (metric.current() if isinstance(metric, Gauge) else metric.values).items()]
+                for name, metric in self.metrics.items()
+            },
+        }
+
+    def render(self, snapshots: Optional[list] = None) -> str:
+        """
+        Render the metrics of this worker, or the sum of the given worker snapshots.
+        """
+        values_by_metric = _merge(self, snapshots) if snapshots else {}
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.samples(values_by_metric.get(name, {}) if snapshots else None))
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _merge(registry: Registry, snapshots: list) -> dict:
+    stale_before = time.time() - Config.METRICS_FLUSH_SEC * 3
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, entries in snapshot["metrics"].items():
+            metric = registry.metrics.get(name)
+            if metric is None:
+                continue
+            # Gauges of workers which stopped reporting are gone, counters stay.
+            if isinstance(metric, Gauge) and snapshot["time"] < stale_before:
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in entries:
+                key = tuple(key)
+                if isinstance(metric, Histogram):
+                    state = values.get(key)
+                    values[key] = value if state is None else [a + b for a, b in zip(state, value)]
+                else:
+                    values[key] = values.get(key, 0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"),
+))
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"),
+))
+HTTP_REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being handled.",
+))
+DB_STATEMENT_DURATION = registry.register(Histogram(
+    "db_statement_duration_seconds", "Database statement execution time.", ("operation", "table"),
+))
+DB_STATEMENT_ROWS = registry.register(Counter(
+    "db_statement_rows_total", "Rows returned or affected by database statements.", ("operation", "table"),
+))
+DB_POOL_CHECKOUT_WAIT = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.",
+))
+ADMISSION_REJECTED = registry.register(Counter(
+    "admission_rejected_total", "Requests rejected by admission control, by reason.", ("reason",),
+))
+ADMISSION_IN_FLIGHT = registry.register(Gauge(
+    "admission_in_flight_requests", "Admitted requests being handled.",
+))
+ADMISSION_QUEUED = registry.register(Gauge(
+    "admission_queued_requests", "Requests waiting for an admission slot.",
+))
+ADMISSION_QUEUE_WAIT = registry.register(Histogram(
+    "admission_queue_wait_seconds", "Time queued requests waited for an admission slot.",
+))
+IDEMPOTENCY_REQUESTS = registry.register(Counter(
+    "idempotency_requests_total", "Requests with an Idempotency-Key, by outcome.", ("outcome",),
+))
+JOBS_PROCESSED = registry.register(Counter(
+    "jobs_processed_total", "Background job runs by job and outcome.", ("job", "outcome"),
+))
+JOB_DURATION = registry.register(Histogram(
+    "job_duration_seconds", "Background job run time by job.", ("job",),
+))
+
+
+# Statement labels
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+"?([A-Za-z_][\w.]*)"?', re.IGNORECASE)
+
+
+@lru_cache(maxsize=2048)
+def statement_labels(statement: str) -> Tuple[str, str]:
+    """
+    Low cardinality labels of a statement: its operation and first table.
+    """
+    stripped = statement.lstrip()
+    operation = stripped.split(None, 1)[0].upper() if stripped else "OTHER"
+    if operation == "WITH":
+        operation = "CTE"
+    match = _TABLE_PATTERN.search(stripped)
+    return operation, match.group(1) if match else ""
+
+
+_instrumented_engines = weakref.WeakSet()
+
+
+def instrument_engine(engine) -> None:
+    """
+    Record statement timing and row counts of the (async) engine, and its pool checkout waits.
+    """
+    from sqlalchemy import event
+    from db import InstrumentedAsyncPool
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if sync_engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(sync_engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        operation, table = statement_labels(statement)
+        DB_STATEMENT_DURATION.observe(time.perf_counter() - started, operation=operation, table=table)
+        rowcount = getattr(cursor, "rowcount", -1)
+        if rowcount and rowcount > 0:
+            DB_STATEMENT_ROWS.inc(rowcount, operation=operation, table=table)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("metrics_started"):
+            connection.info["metrics_started"].pop()
+
+    if DB_POOL_CHECKOUT_WAIT.observe not in InstrumentedAsyncPool.wait_observers:
+        InstrumentedAsyncPool.wait_observers.append(DB_POOL_CHECKOUT_WAIT.observe)
+
+
+def _collect_pools() -> dict:
+    from db import InstrumentedAsyncPool
+
+    values = {}
+    for sync_engine in list(_instrumented_engines):
+        pool = sync_engine.pool
+        if not isinstance(pool, InstrumentedAsyncPool):
+            continue
+        # Host and database only, never the credentials.
+        name = f"{sync_engine.url.host or ''}/{sync_engine.url.database or ''}"
+        values[(name, "size")] = pool.size()
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "overflow")] = pool.overflow()
+    return values
+
+
+DB_POOL_CONNECTIONS = registry.register(Gauge(
+    "db_pool_connections", "Database pool connections by engine and state.", ("engine", "state"),
+    collect=_collect_pools,
+))
+
+
+# Multi-worker aggregation
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"metrics_{pid}.json")
+
+
+def write_snapshot(directory: str = Config.METRICS_MULTIPROC_DIR) -> None:
+    path = _snapshot_path(directory, os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(tmp_path, path)
+
+
+def read_snapshots(directory: str = Config.METRICS_MULTIPROC_DIR) -> list:
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+        if os.path.basename(path) == os.path.basename(_snapshot_path(directory, os.getpid())):
+            continue
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            # Being replaced or removed.
+            continue
+    # This worker's values are always current.
+    snapshots.append(json.loads(json.dumps(registry.snapshot())))
+    return snapshots
+
+
+def render_metrics() -> str:
+    if Config.METRICS_MULTIPROC_DIR:
+        return registry.render(read_snapshots())
+    return registry.render()
+
+
+async def write_snapshots_periodically(interval_sec: float = Config.METRICS_FLUSH_SEC) -> None:
+    os.makedirs(Config.METRICS_MULTIPROC_DIR, exist_ok=True)
+    while True:
+        try:
+            write_snapshot()
+        except OSError:
+            logger.exception("Failed to write the metrics snapshot.")
+        await asyncio.sleep(interval_sec)
@@ -0,0 +1,200 @@
+import asyncio
+import math
+import time
+from typing import Dict, Iterable, Optional
+
+import orjson
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from api.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTED
+from api.repositories.cache import LRUCache
+from config import Config
+
+
+# All admission controllers by name, see `get_admission_stats`.
+controllers: Dict[str, "AdmissionControlMiddleware"] = {}
+
+MAX_CLIENT_KEY_LENGTH = 128
+
+
+class TokenBucket:
+    """
+    `burst` tokens refilled at `rate` per second, one taken per request.
+    """
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        """
+        Take a token, return 0, or the seconds until one is available (nothing taken).
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class ConcurrencyLimiter:
+    """
+    At most `max_in_flight` admitted requests; up to `max_queue` more wait for a
+    slot, for at most `queue_timeout_sec`. Returns the reason of a rejection.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout_sec: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout_sec = queue_timeout_sec
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def acquire(self) -> Optional[str]:
+        if self._semaphore.locked():
+            # Shed before queueing when the queue is full: waiting would only add latency.
+            if self.queued >= self.max_queue:
+                return "queue_full"
+            self.queued += 1
+            ADMISSION_QUEUED.inc()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout_sec)
+            except asyncio.TimeoutError:
+                return "queue_timeout"
+            finally:
+                self.queued -= 1
+                ADMISSION_QUEUED.dec()
+                ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - started)
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        ADMISSION_IN_FLIGHT.inc()
+        return None
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec()
+        self._semaphore.release()
+
+
+class AdmissionControlMiddleware:
+    """
+    Admission control of the (DB-bound) `paths`, other requests pass through.
+    - Per-client token buckets, keyed on the `client_header` (API key) or the client IP,
+      rejects with 429 once a client is over `rate_per_sec` (`burst` at once).
+      Buckets live in a bounded LRU: a bucket idle long enough to be full again
+      expires, so evicting it loses nothing.
+    - A global cap of `max_in_flight` requests, with a bounded wait queue, rejects
+      with 503 when the queue is full or a request waited `queue_timeout_ms`.
+    Rejections carry `Retry-After` and happen before the request body is read.
+    NOTE: limits are per worker process. Keying on the client header trusts its value,
+    authenticate it upstream; the global cap bounds every client anyway.
+    """
+
+    def __init__(self,
+                 app: ASGIApp,
+                 name: str = "default",
+                 paths: Iterable[str] = Config.ADMISSION_PATHS,
+                 client_header: str = Config.ADMISSION_CLIENT_HEADER,
+                 rate_per_sec: float = Config.ADMISSION_RATE_PER_SEC,
+                 burst: int = Config.ADMISSION_BURST,
+                 max_clients: int = Config.ADMISSION_MAX_CLIENTS,
+                 max_in_flight: int = Config.ADMISSION_MAX_IN_FLIGHT,
+                 max_queue: int = Config.ADMISSION_MAX_QUEUE,
+                 queue_timeout_ms: float = Config.ADMISSION_QUEUE_TIMEOUT_MS):
+        self.app = app
+        self.name = name
+        self.paths = frozenset(paths)
+        self.client_header = client_header.lower().encode()
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(burst, 1)
+        # A bucket untouched for `burst / rate` seconds is full, the same as a new one.
+        self.buckets = LRUCache(
+            max_size=max_clients, ttl_sec=self.burst / rate_per_sec if rate_per_sec > 0 else 0,
+        )
+        self.limiter = ConcurrencyLimiter(max_in_flight, max_queue, queue_timeout_ms / 1000)
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+        controllers[name] = self
+
+    def client_key_of(self, scope: Scope) -> str:
+        if self.client_header:
+            for name, value in scope["headers"]:
+                if name == self.client_header:
+                    if 0 < len(value) <= MAX_CLIENT_KEY_LENGTH:
+                        return f"key:{value.decode('latin-1')}"
+                    break
+        client = scope.get("client")
+        return f"ip:{client[0] if client else ''}"
+
+    def retry_after_rate_limit(self, scope: Scope) -> float:
+        """
+        0 when the client has a token, the seconds until it gets one otherwise.
+        """
+        if self.rate_per_sec <= 0:
+            return 0.0
+        key = self.client_key_of(scope)
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+        wait_sec = bucket.take(self.rate_per_sec, self.burst, now)
+        # Set on every request, so an active bucket does not expire.
+        self.buckets.set(key, bucket)
+        return wait_sec
+
+    async def reject(self, send: Send, status_code: int, reason: str, retry_after_sec: float) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        detail = "Too many requests." if status_code == 429 else "Service overloaded, retry later."
+        body = orjson.dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after_sec))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after_sec = self.retry_after_rate_limit(scope)
+        if retry_after_sec:
+            await self.reject(send, 429, "rate_limited", retry_after_sec)
+            return
+
+        reason = await self.limiter.acquire()
+        if reason is not None:
+            await self.reject(send, 503, reason, self.limiter.queue_timeout_sec)
+            return
+        self.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "in_flight": self.limiter.in_flight,
+            "queued": self.limiter.queued,
+            "max_in_flight": self.limiter.max_in_flight,
+            "max_queue": self.limiter.max_queue,
+            "clients": len(self.buckets),
+            "client_evictions": self.buckets.evictions,
+        }
+
+
+def get_admission_stats() -> dict:
+    return {name: controller.stats() for name, controller in controllers.items()}
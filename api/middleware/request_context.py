@@ -0,0 +1,75 @@
+import logging
+import random
+import time
+import uuid
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import Config
+from logs import request_id_var
+
+access_logger = logging.getLogger("api.access")
+
+REQUEST_ID_HEADER = b"x-request-id"
+MAX_REQUEST_ID_LENGTH = 128
+
+
+class RequestContextMiddleware:
+    """
+    Give every request an id, taken from its `X-Request-ID` header or generated,
+    which is sent back in the response and attached to the records logged while
+    handling it. Writes the access log: a `sample_rate` share of the requests, plus
+    every server error and every request slower than `slow_request_ms`.
+    """
+
+    def __init__(self,
+                 app: ASGIApp,
+                 sample_rate: float = Config.LOG_ACCESS_SAMPLE_RATE,
+                 slow_request_ms: float = Config.LOG_SLOW_REQUEST_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_request_ms = slow_request_ms
+
+    @staticmethod
+    def request_id_of(scope: Scope) -> str:
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                if 0 < len(value) <= MAX_REQUEST_ID_LENGTH and value.isascii() and value.decode().isprintable():
+                    return value.decode()
+                break
+        return uuid.uuid4().hex
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = self.request_id_of(scope)
+        token = request_id_var.set(request_id)
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", ()), (REQUEST_ID_HEADER, request_id.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if status_code >= 500 or duration_ms >= self.slow_request_ms or random.random() < self.sample_rate:
+                client = scope.get("client")
+                access_logger.info(
+                    "%s %s %s", scope["method"], scope["path"], status_code,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 3),
+                        "client": client[0] if client else None,
+                    },
+                )
+            request_id_var.reset(token)
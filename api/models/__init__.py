@@ -1,2 +1,5 @@
 from api.models.base import BaseModel
-from api.models.items import Items
\ No newline at end of file
+from api.models.counters import RowCount
+from api.models.idempotency import IdempotencyKey
+from api.models.items import Items
+from api.models.jobs import Job
\ No newline at end of file
@@ -13,7 +13,8 @@ class BaseModel(Base):
 
     __abstract__ = True
 
-    id = Column(Uuid, primary_key=True, index=True)
+    # The primary key is indexed already, ids are time-ordered (see `api.ids`).
+    id = Column(Uuid, primary_key=True)
     # created_by = 
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=True, onupdate=datetime.utcnow)
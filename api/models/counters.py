@@ -0,0 +1,57 @@
+from sqlalchemy import BigInteger, Column, DDL, Integer, String, Table, event
+
+from api.models.base import Base
+
+
+class RowCount(Base):
+    """
+    Row count deltas of tracked tables, written by statement-level triggers.
+    The count of a table is the sum of its deltas, see `BaseRepository.get_count`.
+    Appending deltas (instead of updating a single counter row) keeps concurrent
+    inserts from queueing on one row lock.
+    """
+
+    __tablename__ = "row_counts"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(63), nullable=False, index=True)
+    delta = Column(BigInteger, nullable=False)
+
+
+ROW_COUNTS_FUNCTION = DDL("""
+CREATE OR REPLACE FUNCTION row_counts_track() RETURNS trigger AS $body$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO row_counts (table_name, delta)
+        SELECT TG_TABLE_NAME, count(*) FROM new_rows HAVING count(*) > 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO row_counts (table_name, delta)
+        SELECT TG_TABLE_NAME, -count(*) FROM old_rows HAVING count(*) > 0;
+    END IF;
+    RETURN NULL;
+END
+$body$ LANGUAGE plpgsql
+""")
+
+
+def track_row_count(table: Table) -> None:
+    """
+    Maintain the `row_counts` deltas of the table with triggers, created along with the table.
+    NOTE: TRUNCATE is not tracked.
+    """
+    name = table.name
+    ddl_statements = [
+        ROW_COUNTS_FUNCTION,
+        DDL(f"""
+            CREATE TRIGGER {name}_row_count_insert AFTER INSERT ON {name}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION row_counts_track()
+        """),
+        DDL(f"""
+            CREATE TRIGGER {name}_row_count_delete AFTER DELETE ON {name}
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION row_counts_track()
+        """),
+    ]
+    for ddl in ddl_statements:
+        event.listen(table, "after_create", ddl.execute_if(dialect="postgresql"))
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Index, Integer, JSON, String
+
+from api.models.base import BaseModel
+
+
+class IdempotencyKey(BaseModel):
+    """
+    Responses of requests sent with an `Idempotency-Key` header, by client and key.
+    The row is inserted in the transaction of the request, so the unique index lets
+    a single request per key do the work, and stored along with the response.
+    """
+
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_client_key", "client", "key", unique=True),
+        # Expired keys purge
+        Index("ix_idempotency_keys_created_at", "created_at"),
+    )
+
+    client = Column(String(255), nullable=False)
+    key = Column(String(255), nullable=False)
+    # Hash of the request payload, a key reused with another payload is refused.
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response = Column(JSON, nullable=True)
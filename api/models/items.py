@@ -1,10 +1,38 @@
-from sqlalchemy.orm import relationship
-from sqlalchemy import Column, String, Integer, ForeignKey, Uuid, Boolean, Text
+from datetime import datetime
+from sqlalchemy.orm import declared_attr, relationship
+from sqlalchemy import Column, DateTime, String, Integer, ForeignKey, Uuid, Boolean, Text, Index, Numeric, text
 from api.models import BaseModel
+from api.models.counters import track_row_count
+from api.models.partitions import partition_by_month
 
 
 class Items(BaseModel):
     __tablename__ = "items"
+    # Matched to the repository access patterns, keep in sync with the migrations.
+    __table_args__ = (
+        # `get_by_column_value("item_id", ...)`, keyset pages sorted by item_id.
+        # NOTE: not unique, a unique index of a partitioned table has to include created_at.
+        # Item ids are unique by generation, see `api.ids`.
+        Index("ix_items_item_id", "item_id"),
+        # Keyset pages sorted by created_at, created_at range filters
+        Index("ix_items_created_at_id", "created_at", "id"),
+        # Active items, newest first, without indexing the inactive ones
+        Index(
+            "ix_items_active_created_at_id", "created_at", "id",
+            postgresql_where=text("is_active"), sqlite_where=text("is_active"),
+        ),
+        Index("ix_items_ip_address", "ip_address"),
+        # Monthly partitions on PostgreSQL, old months are dropped whole, see `MonthlyPartitions`.
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # The partition key is part of the table primary key, entries are still identified by id.
+    id = Column(Uuid, primary_key=True)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
+
+    @declared_attr.directive
+    def __mapper_args__(cls):
+        return {"primary_key": [cls.__table__.c.id]}
 
     item_id = Column(String, nullable=False)
     title = Column(String(255))
@@ -12,7 +40,13 @@ class Items(BaseModel):
     is_active = Column(Boolean, default=False)
     items_number = Column(Integer)
     ip_address = Column(String, nullable=True)
+    # Set by the enrichment, NULL until it ran, see `ItemsRepository.enrich_item`.
+    price = Column(Numeric(12, 2, asdecimal=False), nullable=True)
     
 
     def __repr__(self):
-        return f"{self.title}"
\ No newline at end of file
+        return f"{self.title}"
+
+
+track_row_count(Items.__table__)
+partition_by_month(Items.__table__)
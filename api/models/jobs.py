@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, JSON, String, Text, text
+
+from api.models.base import BaseModel
+
+
+class Job(BaseModel):
+    """
+    Durable background jobs, see `api.repositories.jobs.JobQueue`.
+    A job is pending until it succeeds (the row is deleted) or runs out of attempts
+    (status "failed", kept for inspection). A claimed job gets `run_at` pushed by the
+    lease, so it is claimed again if its worker dies.
+    """
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Claim query: pending jobs due first, without indexing the failed ones
+        Index(
+            "ix_jobs_pending_run_at", "run_at",
+            postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'"),
+        ),
+    )
+
+    name = Column(String(255), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(16), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
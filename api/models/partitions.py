@@ -0,0 +1,34 @@
+from sqlalchemy import DDL, Table, event
+
+
+# Monthly partitions `<table>_pYYYYMM` of the current month and `premake` months ahead.
+# Timestamps are naive UTC (`datetime.utcnow`), so is the current month.
+MONTHLY_PARTITIONS = """
+DO $body$
+DECLARE
+    month timestamp;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', now() AT TIME ZONE 'UTC'),
+        date_trunc('month', now() AT TIME ZONE 'UTC') + interval '{premake} months',
+        interval '1 month'
+    ) LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)',
+            '{table}_p' || to_char(month, 'YYYYMM'), month, month + interval '1 month'
+        );
+    END LOOP;
+END
+$body$
+"""
+
+
+def partition_by_month(table: Table, premake: int = 3) -> None:
+    """
+    Create the first monthly partitions of a table declared with
+    `postgresql_partition_by="RANGE (<column>)"`, along with the table. Later months are
+    created by the maintenance job, see `api.repositories.partitions.MonthlyPartitions`.
+    """
+    # `DDL` statements go through %-formatting, escape the `format()` placeholders.
+    ddl = DDL(MONTHLY_PARTITIONS.format(table=table.name, premake=premake).replace("%", "%%"))
+    event.listen(table, "after_create", ddl.execute_if(dialect="postgresql"))
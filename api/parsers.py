@@ -0,0 +1,151 @@
+from typing import Any, NamedTuple, Optional, Tuple
+
+import msgpack
+import orjson
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from config import Config
+
+
+JSON_MEDIA_TYPES = ('application/json',)
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+FORM_MEDIA_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+class RequestPayload(NamedTuple):
+    """
+    Uniform result of request body parsing, whatever the body format was.
+    """
+    method: str
+    content_type: str  # media type, without parameters
+    data: Any  # dict of a single item, list of a batch
+
+
+def parse_content_type(header: Optional[str]) -> Tuple[str, dict]:
+    """
+    Split a Content-Type header into the lowercased media type and its parameters,
+    e.g. `application/json; charset=utf-8` -> ('application/json', {'charset': 'utf-8'}).
+    """
+    if not header:
+        return '', {}
+    media_type, *raw_params = header.split(';')
+    params = {}
+    for raw_param in raw_params:
+        name, _, value = raw_param.partition('=')
+        if name.strip():
+            params[name.strip().lower()] = value.strip().strip('"')
+    media_type = media_type.strip().lower()
+    # Structured syntax suffix, e.g. `application/vnd.seller+json`
+    if media_type.endswith('+json'):
+        media_type = 'application/json'
+    return media_type, params
+
+
+async def read_body(request: Request, max_size: int) -> bytes:
+    """
+    Read the request body while streaming it, rejecting it as soon as it exceeds `max_size` bytes.
+    """
+    content_length = request.headers.get('Content-Length')
+    if content_length is not None:
+        try:
+            too_large = int(content_length) > max_size
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid Content-Length!')
+        if too_large:
+            raise HTTPException(status_code=413, detail=f'Request body exceeds {max_size} bytes!')
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=413, detail=f'Request body exceeds {max_size} bytes!')
+        chunks.append(chunk)
+    body = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    # Later `request.body()` / `request.form()` calls reuse the body read here.
+    request._body = body
+    return body
+
+
+def decode_json(body: bytes) -> Any:
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def decode_msgpack(body: bytes) -> Any:
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f'Invalid msgpack body: {e}')
+
+
+def decode_ndjson(body: bytes) -> list:
+    data = []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data.append(orjson.loads(line))
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f'Line {line_number}: {e}')
+    return data
+
+
+async def parse_item(request: Request, max_size: int = Config.MAX_BODY_SIZE) -> RequestPayload:
+    """
+    Parse a single item sent as query params, JSON, msgpack or form data.
+    """
+    media_type, _ = parse_content_type(request.headers.get('Content-Type'))
+    if not media_type:
+        url_params = request.query_params
+        if url_params:
+            return RequestPayload('GET', '', dict(url_params))
+        raise HTTPException(status_code=400, detail='No Content-Type provided!')
+
+    if media_type in JSON_MEDIA_TYPES:
+        data = decode_json(await read_body(request, max_size))
+    elif media_type in MSGPACK_MEDIA_TYPES:
+        data = decode_msgpack(await read_body(request, max_size))
+    elif media_type in FORM_MEDIA_TYPES:
+        await read_body(request, max_size)
+        try:
+            data = dict(await request.form())
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        raise HTTPException(status_code=400, detail='Content-Type not supported!')
+
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail='Object of item fields expected!')
+    return RequestPayload('POST', media_type, data)
+
+
+async def parse_batch(request: Request,
+                      max_size: int = Config.MAX_BATCH_BODY_SIZE,
+                      max_items: int = Config.ITEMS_BATCH_MAX_SIZE) -> RequestPayload:
+    """
+    Parse a batch of items sent as a JSON array, a msgpack array or NDJSON (one item per line).
+    """
+    media_type, _ = parse_content_type(request.headers.get('Content-Type'))
+    if not media_type:
+        raise HTTPException(status_code=400, detail='No Content-Type provided!')
+
+    if media_type in JSON_MEDIA_TYPES:
+        data = decode_json(await read_body(request, max_size))
+    elif media_type in MSGPACK_MEDIA_TYPES:
+        data = decode_msgpack(await read_body(request, max_size))
+    elif media_type in NDJSON_MEDIA_TYPES:
+        data = decode_ndjson(await read_body(request, max_size))
+    else:
+        raise HTTPException(status_code=400, detail='Content-Type not supported!')
+
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail='Array of items expected!')
+    if len(data) > max_items:
+        raise HTTPException(status_code=413, detail=f'Batch exceeds {max_items} items!')
+    return RequestPayload('POST', media_type, data)
@@ -1,3 +1,9 @@
+from config import Config
+from api.repositories.idempotency import IdempotencyRepository
 from api.repositories.items import ItemsRepository
+from api.repositories.jobs import JobQueue, JobsRepository
 
-items_repository = ItemsRepository()
\ No newline at end of file
+jobs_repository = JobsRepository()
+job_queue = JobQueue(jobs_repository)
+idempotency_repository = IdempotencyRepository()
+items_repository = ItemsRepository(job_queue=job_queue if Config.JOBS_ENABLED else None)
@@ -1,47 +1,310 @@
+import asyncio
+import logging
 import uuid
-from typing import Optional, Union, Sequence
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional, Union, Sequence, List, AsyncIterator, Mapping
 
 from sqlalchemy import delete as sqlalchemy_delete
-from sqlalchemy import func
+from sqlalchemy import bindparam, func, text, tuple_
 from sqlalchemy import update as sqlalchemy_update
 from sqlalchemy import insert as sqlalchemy_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import joinedload, contains_eager
+from sqlalchemy.orm import make_transient_to_detached
 
+from config import Config
+from api.ids import IdGenerator, pk_generator
+from db import PRIMARY, REPLICA, AsyncSessionLocal, route, routed
 from api.models.base import BaseModel
+from api.models.counters import RowCount
+from api.repositories.cache import LRUCache, RepositoryCache
+from api.repositories.loaders import loader_options, loader_spec
+from api.repositories.query import QueryBuilder
+from api.repositories.pagination import NEXT, PREV, encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+COUNT_STRATEGIES = ("exact", "cached", "counter", "estimate")
+
+# `AsyncSession.info` keys of the unit of work
+UNIT_OF_WORK_KEY = "unit_of_work"
+AFTER_COMMIT_KEY = "unit_of_work_after_commit"
+
+
+@asynccontextmanager
+async def unit_of_work(session: AsyncSession) -> AsyncIterator[AsyncSession]:
+    """
+    Make repository writes inside the block join one transaction, committed once
+    when the block ends (rolled back on error). Nested blocks join the outer one.
+    Reads inside the block go to the primary, consistent with the writes.
+    Example call:
+        ```
+    async with unit_of_work(session):
+        entry = await repository.create(session, **data)
+        await repository.update(session, entry.id, is_active=True)
+        ```
+    """
+    if session.info.get(UNIT_OF_WORK_KEY):
+        yield session
+        return
+
+    session.info[UNIT_OF_WORK_KEY] = True
+    try:
+        with route(session, PRIMARY):
+            yield session
+            await session.commit()
+    except BaseException:
+        await session.rollback()
+        session.info.pop(AFTER_COMMIT_KEY, None)
+        raise
+    finally:
+        session.info.pop(UNIT_OF_WORK_KEY, None)
+
+    for callback in session.info.pop(AFTER_COMMIT_KEY, []):
+        await callback()
 
 
 class BaseRepository:
+    # Columns allowed for keyset pagination, they should be NOT NULL and indexed together with `id`.
+    keyset_sort_columns = ("created_at", "id")
+    # Time-ordered by default, see `api.ids`.
+    id_generator: IdGenerator = pk_generator
+
     def __init__(self):
         self.model = BaseModel
+        # Optional read-through cache of `get` / `get_by_column_value`, see `RepositoryCache`.
+        self.cache: Optional[RepositoryCache] = None
+        # Exact counts for the "cached" count strategy, keyed by filters.
+        self._count_cache = LRUCache(max_size=Config.COUNT_CACHE_MAX_SIZE, ttl_sec=Config.COUNT_CACHE_TTL_SEC)
     
 
     async def generate_id(self) -> uuid.UUID:
-        return uuid.uuid4()
+        return self.id_generator.new()
+
+
+    async def generate_ids(self, count: int) -> List[uuid.UUID]:
+        """
+        Preallocate the ids of a bulk insert in one go, in ascending order.
+        """
+        return self.id_generator.batch(count)
     
 
+    async def _commit(self, session: AsyncSession, *invalidated_pks) -> None:
+        """
+        Commit a repository write. Within `unit_of_work` only flush it, the commit is done
+        once by the unit of work. Cached entries of `invalidated_pks` are dropped right away
+        and once more after the commit, so a read racing the commit can not keep a stale entry.
+        """
+        await self.invalidate_cache(*invalidated_pks)
+        if session.info.get(UNIT_OF_WORK_KEY):
+            await session.flush()
+            if invalidated_pks and self.cache is not None:
+                session.info.setdefault(AFTER_COMMIT_KEY, []).append(
+                    lambda: self.invalidate_cache(*invalidated_pks)
+                )
+            return
+
+        await session.commit()
+        await self.invalidate_cache(*invalidated_pks)
+
+
     async def create(self, session: AsyncSession, **kwargs) -> BaseModel:
+        """
+        INSERT ... RETURNING, the entry comes back with its column defaults in the same round trip.
+        """
         kwargs['id'] = await self.generate_id()
-        entry = self.model(**kwargs)
-        session.add(entry)
-        await session.commit()
+        query = sqlalchemy_insert(self.model).returning(self.model)
+        entries = await session.execute(query, [kwargs])
+        entry = entries.scalars().one()
+        await self._commit(session)
         return entry
 
 
+    async def bulk_create(self, session: AsyncSession, entries: Sequence[dict], use_copy: Optional[bool] = None) -> List[uuid.UUID]:
+        """
+        Insert many entries in one transaction and return their ids.
+        Ids are generated before the insert, so no RETURNING round trip is needed.
+        `use_copy=None` switches to COPY from `Config.BULK_COPY_THRESHOLD` rows on.
+        """
+        if not entries:
+            return []
+
+        rows = [dict(entry) for entry in entries]
+        await self._fill_ids(rows)
+
+        if use_copy is None:
+            use_copy = len(rows) >= Config.BULK_COPY_THRESHOLD
+
+        if use_copy:
+            await self.copy_records(session, rows)
+        else:
+            # executemany, batched by the driver
+            await session.execute(sqlalchemy_insert(self.model), rows)
+        await self._commit(session)
+        return [row['id'] for row in rows]
+
+
+    async def bulk_upsert(
+        self, session: AsyncSession,
+        entries: Sequence[dict],
+        conflict_columns: Sequence[str],
+        update_columns: Optional[Sequence[str]] = None,
+        ) -> List[uuid.UUID]:
+        """
+        Insert many entries, updating the existing rows on `conflict_columns` clash
+        (INSERT ... ON CONFLICT DO UPDATE ... RETURNING id).
+        `conflict_columns` must be covered by a unique index/constraint.
+        By default every column except the pk, `created_at` and the conflict columns is updated.
+        Returns the ids of the inserted or updated rows.
+        """
+        if not entries:
+            return []
+
+        columns = self.model.__table__.columns
+        for column_name in conflict_columns:
+            if column_name not in columns:
+                raise RuntimeError(f"Non-existing column name '{column_name}' is passed in.")
+
+        if update_columns is None:
+            update_columns = [
+                column.name for column in columns
+                if column.name not in ('id', 'created_at', *conflict_columns)
+            ]
+
+        # A row may be affected only once per statement, keep the last entry of each key.
+        rows_by_key = {}
+        for entry in entries:
+            row = dict(entry)
+            rows_by_key[tuple(row.get(name) for name in conflict_columns)] = row
+        rows = list(rows_by_key.values())
+        await self._fill_ids(rows)
+
+        query = postgresql_insert(self.model)
+        set_ = {name: query.excluded[name] for name in update_columns}
+        if 'updated_at' in columns and 'updated_at' not in set_:
+            set_['updated_at'] = datetime.utcnow()
+        query = query.on_conflict_do_update(
+            index_elements=list(conflict_columns),
+            set_=set_,
+        ).returning(self.model.id)
+
+        result = await session.execute(query, rows)
+        ids = result.scalars().all()
+        await self._commit(session, *ids)
+        return ids
+
+
+    async def bulk_update(self, session: AsyncSession, entries: Sequence[dict]) -> None:
+        """
+        Update many entries by pk in one executemany UPDATE, each entry being the "id"
+        and the column values of a row. Every entry has to set the same columns.
+        Example call:
+            ```
+        await self.bulk_update(session, [{"id": pk, "price": price} for pk, price in prices])
+            ```
+        """
+        if not entries:
+            return
+
+        column_names = [name for name in entries[0] if name != 'id']
+        table = self.model.__table__
+        for column_name in column_names:
+            if column_name not in table.columns:
+                raise RuntimeError(f"Non-existing column name '{column_name}' is passed in.")
+
+        # Bound parameters may not be named after the updated columns, hence the "_" prefix.
+        query = (
+            sqlalchemy_update(table)
+            .where(table.c.id == bindparam("_id"))
+            .values({name: bindparam(f"_{name}") for name in column_names})
+        )
+        rows = [{f"_{name}": entry[name] for name in ('id', *column_names)} for entry in entries]
+        await session.execute(query, rows)
+        await self._commit(session, *[entry['id'] for entry in entries])
+
+
+    async def _fill_ids(self, rows: List[dict]) -> None:
+        missing = [row for row in rows if row.get('id') is None]
+        for row, pk in zip(missing, await self.generate_ids(len(missing))):
+            row['id'] = pk
+
+
+    async def copy_records(self, session: AsyncSession, rows: Sequence[dict]) -> None:
+        """
+        Write rows with asyncpg COPY, the fastest path for large batches.
+        NOTE: COPY bypasses SQLAlchemy, python-side column defaults are applied here.
+        """
+        table = self.model.__table__
+        columns = list(table.columns)
+        records = [
+            tuple(self._column_value(column, row) for column in columns)
+            for row in rows
+        ]
+
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            table.name,
+            records=records,
+            columns=[column.name for column in columns],
+            schema_name=table.schema,
+        )
+
+
+    @staticmethod
+    def _column_value(column, row: dict):
+        if column.name in row:
+            return row[column.name]
+        default = column.default
+        if default is None:
+            return None
+        if default.is_callable:
+            return default.arg(None)
+        if default.is_scalar:
+            return default.arg
+        return None
+
+
     async def update(self, session: AsyncSession, pk: int, **kwargs) -> BaseModel:
+        """
+        UPDATE ... RETURNING, the updated entry comes back in the same round trip
+        (None when there is no such entry). Entries already loaded in the session are refreshed.
+        """
+        table = self.model.__table__
         query = (
-        sqlalchemy_update(self.model)
-        .where(self.model.id == pk)
+        sqlalchemy_update(table)
+        .where(table.c.id == pk)
         .values(**kwargs)
-        .execution_options(synchronize_session="fetch")
+        .returning(*table.columns)
         )
-        await session.execute(query)
-        await session.commit()
-        return await self.get(session, pk)
+        entries = await session.execute(query)
+        row = entries.first()
+        entry = None
+        if row is not None:
+            # NOTE: an ORM UPDATE ... RETURNING leaves a loaded entry stale (populate_existing
+            # is ignored), the returned values are merged into the session instead, no query.
+            mapper = self.model.__mapper__
+            entry = self.model(**{
+                mapper.get_property_by_column(column).key: value for column, value in zip(table.columns, row)
+            })
+            make_transient_to_detached(entry)
+            entry = await session.merge(entry, load=False)
+        await self._commit(session, pk)
+        return entry
 
 
+    @routed(REPLICA)
     async def get(self, session: AsyncSession, pk: int) -> BaseModel:
+        if self.cache is not None:
+            values = await self.cache.get_or_load(
+                self._cache_key("id", pk),
+                lambda: self._load_values(session, pk),
+            )
+            return await self._entry_from_values(session, values)
+
         query = select(self.model).where(self.model.id == pk)  # NOQA
         entries = await session.execute(query)
 
@@ -53,6 +316,7 @@ class BaseRepository:
         return entry
 
 
+    @routed(REPLICA)
     async def get_by_column_value(self, session: AsyncSession, column_name: str, value: Union[str, int] ) -> Union[str, int]:
         """
         Get an entry by non-pk column value.
@@ -65,6 +329,9 @@ class BaseRepository:
         if not column_value:
             raise RuntimeError(f"Non-existing column name '{column_name}' is passed in.")
 
+        if self.cache is not None:
+            return await self._get_cached_by_column_value(session, column_name, column_value, value)
+
         query = select(self.model).where(column_value == value)
         entries = await session.execute(query)
         first_entry = entries.first()
@@ -75,38 +342,138 @@ class BaseRepository:
         return entry
 
 
-    async def get_list_all(self, session: AsyncSession):
-        query = select(self.model)
+    def _cache_key(self, column_name: str, value) -> str:
+        return f"{self.model.__tablename__}:{column_name}:{value}"
+
+
+    async def invalidate_cache(self, *pks) -> None:
+        """
+        Drop cached entries of the given pks. Entries cached by other column values
+        are dropped lazily, as they are checked against the pk entry on read.
+        """
+        if self.cache is not None and pks:
+            await self.cache.invalidate(*[self._cache_key("id", pk) for pk in pks])
+
+
+    async def _load_values(self, session: AsyncSession, pk) -> Optional[dict]:
+        query = select(self.model).where(self.model.id == pk)  # NOQA
         entries = await session.execute(query)
-        data = entries.scalars().all()
-        return data
+        entry = entries.scalars().first()
+        if entry is None:
+            return None
+        return {
+            column.key: getattr(entry, column.key)
+            for column in self.model.__mapper__.column_attrs
+        }
 
 
-    async def get_list_paginated(self, session: AsyncSession, page: int, page_size: int):
-        query = select(self.model).limit(page_size).offset(page * page_size)
+    async def _entry_from_values(self, session: AsyncSession, values: Optional[dict]) -> Optional[BaseModel]:
+        """
+        Attach cached column values to the session as a persistent entry without a query.
+        """
+        if values is None:
+            return None
+        entry = self.model(**values)
+        make_transient_to_detached(entry)
+        return await session.merge(entry, load=False)
+
+
+    async def _get_cached_by_column_value(self, session: AsyncSession, column_name: str, column, value):
+        """
+        Non-pk lookups cache only the pk of the entry, the entry itself comes from the pk cache,
+        so `update` / `delete` invalidating the pk entry is enough.
+        """
+        key = self._cache_key(column_name, value)
+
+        async def load_reference():
+            entries = await session.execute(select(self.model.id).where(column == value))
+            pk = entries.scalars().first()
+            return None if pk is None else {"id": pk}
+
+        reference = await self.cache.get_or_load(key, load_reference)
+        if reference is None:
+            return None
+
+        entry = await self.get(session, reference["id"])
+        if entry is None or getattr(entry, column_name) != value:
+            # The entry was deleted or its column changed since the pk was cached.
+            await self.cache.invalidate(key)
+            entries = await session.execute(select(self.model).where(column == value))
+            entry = entries.scalars().first()
+        return entry
+
+
+    @routed(REPLICA)
+    async def get_list_all(self, session: AsyncSession):
+        """
+        NOTE: loads the whole table into memory, use `stream_rows` for big tables.
+        """
+        query = select(self.model)
         entries = await session.execute(query)
         data = entries.scalars().all()
         return data
 
 
-    async def get_list_sorted(self, session: AsyncSession, sort_column_name: str, sort_order: str):
-        sort_column_name = getattr(self.model, sort_column_name, None)
+    @routed(REPLICA)
+    async def stream_rows(
+        self, session: AsyncSession,
+        column_names: Optional[Sequence[str]] = None,
+        fetch_size: Optional[int] = None,
+        ) -> AsyncIterator[Sequence[tuple]]:
+        """
+        Stream plain row tuples of the table through a server-side cursor,
+        `fetch_size` rows at a time, without building ORM objects.
+        Memory stays bounded by `fetch_size` regardless of the table size.
+        Example call:
+            ```
+        async for rows in self.stream_rows(session, column_names=["id", "title"]):
+            ...
+            ```
+        """
+        table_columns = self.model.__table__.columns
+        if column_names:
+            for column_name in column_names:
+                if column_name not in table_columns:
+                    raise RuntimeError(f"Non-existing column name '{column_name}' is passed in.")
+            columns = [table_columns[column_name] for column_name in column_names]
+        else:
+            columns = list(table_columns)
 
-        if not sort_column_name:
-            raise RuntimeError(f"Non-existing column name '{sort_column_name}'.")
+        query = select(*columns).execution_options(yield_per=fetch_size or Config.STREAM_FETCH_SIZE)
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            yield rows
 
-        if sort_order not in ("asc", "desc"):
-            raise RuntimeError(f"Improper sorting order '{sort_order}'.")
 
-        if sort_order == "desc":
-            query = select(self.model).order_by(sort_column_name.desc())
-        else:
-            query = select(self.model).order_by(sort_column_name.asc())
+    def query(self) -> QueryBuilder:
+        """
+        Start a list query of the repository model, see `QueryBuilder`.
+        """
+        return QueryBuilder(self.model)
 
-        entries = await session.execute(query)
 
+    @routed(REPLICA)
+    async def get_list(self, session: AsyncSession, query: QueryBuilder):
+        statement, params = query.statement()
+        entries = await session.execute(statement, params)
+        if query.loads_related:
+            # Joined collections repeat the parent rows.
+            entries = entries.unique()
         data = entries.scalars().all()
         return data
+
+
+    async def get_list_paginated(self, session: AsyncSession, page: int, page_size: int):
+        """
+        NOTE: OFFSET pagination gets slower with every page, prefer `get_list_keyset`.
+        """
+        query = self.query().paginate(limit=page_size, offset=page * page_size)
+        return await self.get_list(session, query)
+
+
+    async def get_list_sorted(self, session: AsyncSession, sort_column_name: str, sort_order: str):
+        query = self.query().sort(sort_column_name, sort_order)
+        return await self.get_list(session, query)
     
 
     async def get_list_sorted_paginated(
@@ -119,36 +486,136 @@ class BaseRepository:
         sort_order: Optional[str],
         ):
         """
-        Get a list of entries with multiple custom conditions.
-        NOTE: create a query builder layer for use in repositories
+        Get a list of entries with multiple custom conditions, see `get_list` for more of them.
+        NOTE: OFFSET pagination gets slower with every page, prefer `get_list_keyset`.
         """
-        query = select(self.model)
+        query = self.query()
+        if sort_column_name is not None:
+            query = query.sort(sort_column_name, sort_order or "asc")
+
+        if page_size:
+            query = query.paginate(limit=page_size, offset=page * page_size)
 
-        if sort_column_name and sort_order:
-            sort_column_name = getattr(self.model, sort_column_name, None)
+        return await self.get_list(session, query)
+    
 
-        if not sort_column_name:
-            raise RuntimeError(f"Non-existing column name '{sort_column_name}'.")
+    @routed(REPLICA)
+    async def get_list_keyset(
+        self, session: AsyncSession,
+        page_size: int,
+        sort_column_name: str = "created_at",
+        sort_order: str = "desc",
+        cursor: Optional[str] = None,
+        ) -> dict:
+        """
+        Get a page of entries with keyset (cursor) pagination on `(sort column, id)`.
+        Every page costs the same regardless of its depth and rows inserted meanwhile
+        do not shift the pages. Returns the entries with the cursors of the next and
+        previous pages (None when there is no such page).
+        """
+        if sort_column_name not in self.keyset_sort_columns:
+            raise RuntimeError(f"Sorting by '{sort_column_name}' is not supported.")
 
-        if sort_order and sort_order not in ("asc", "desc"):
+        if sort_order not in ("asc", "desc"):
             raise RuntimeError(f"Improper sorting order '{sort_order}'.")
 
-        if sort_order == "desc":
-            query = query.order_by(sort_column_name.desc())
-        else:
-            query = query.order_by(sort_column_name.asc())
+        sort_column = getattr(self.model, sort_column_name)
+        key_columns = [sort_column] if sort_column_name == "id" else [sort_column, self.model.id]
 
-        if page_size:
-            query = query.limit(page_size).offset(page * page_size)
+        direction = NEXT
+        query = select(self.model)
+        if cursor:
+            values, direction = decode_cursor(
+                cursor, [column.expression for column in key_columns], sort_column_name, sort_order,
+            )
+            key, key_values = tuple_(*key_columns), tuple_(*values)
+            # Walking backwards is a forward walk in the opposite order.
+            if (sort_order == "asc") == (direction == NEXT):
+                query = query.where(key > key_values)
+            else:
+                query = query.where(key < key_values)
 
-        entries = await session.execute(query)
+        ascending = (sort_order == "asc") == (direction == NEXT)
+        query = query.order_by(*[column.asc() if ascending else column.desc() for column in key_columns])
+        # One extra row tells whether there is a page after this one.
+        query = query.limit(page_size + 1)
 
+        entries = await session.execute(query)
         data = entries.scalars().all()
-        return data
-    
 
-    async def get_count(self, session: AsyncSession) -> int:
+        has_more = len(data) > page_size
+        data = data[:page_size]
+        if direction == PREV:
+            data.reverse()
+
+        def cursor_of(entry, cursor_direction):
+            values = [getattr(entry, column.key) for column in key_columns]
+            return encode_cursor(values, cursor_direction, sort_column_name, sort_order)
+
+        next_cursor = prev_cursor = None
+        if data:
+            if (direction == NEXT and has_more) or direction == PREV:
+                next_cursor = cursor_of(data[-1], NEXT)
+            if (direction == NEXT and cursor) or (direction == PREV and has_more):
+                prev_cursor = cursor_of(data[0], PREV)
+
+        return {
+            "entries": data,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+        }
+
+
+    @routed(REPLICA)
+    async def get_count(self, session: AsyncSession, strategy: Optional[str] = None, **filters) -> int:
+        """
+        Count entries, optionally filtered by column values (`column_name=value`).
+        Strategies, from the most precise to the cheapest:
+            - "exact": `SELECT count(id)`, a full scan on big tables (default).
+            - "cached": exact count cached for `Config.COUNT_CACHE_TTL_SEC`.
+            - "counter": sum of the trigger-maintained `row_counts` deltas, see `track_row_count`
+              and `compact_row_counts`.
+            - "estimate": planner estimate from `pg_class.reltuples`, as fresh as the last ANALYZE.
+        "counter" and "estimate" do not support filters and fall back to "cached" with them,
+        or on other dialects than PostgreSQL (no triggers, no planner statistics).
+        """
+        strategy = strategy or "exact"
+        if strategy not in COUNT_STRATEGIES:
+            raise RuntimeError(f"Improper count strategy '{strategy}'.")
+
+        for column_name in filters:
+            if column_name not in self.model.__table__.columns:
+                raise RuntimeError(f"Non-existing column name '{column_name}' is passed in.")
+
+        if filters and strategy in ("counter", "estimate"):
+            strategy = "cached"
+
+        if strategy == "estimate":
+            count = await self._get_count_estimate(session)
+            if count is not None:
+                return count
+            strategy = "cached"
+
+        if strategy == "counter":
+            if session.bind.dialect.name == "postgresql":
+                return await self._get_count_counter(session)
+            strategy = "cached"
+
+        if strategy == "cached":
+            key = tuple(sorted(filters.items()))
+            count = self._count_cache.get(key)
+            if count is None:
+                count = await self._get_count_exact(session, **filters)
+                self._count_cache.set(key, count)
+            return count
+
+        return await self._get_count_exact(session, **filters)
+
+
+    async def _get_count_exact(self, session: AsyncSession, **filters) -> int:
         query = select(func.count(self.model.id))
+        for column_name, value in filters.items():
+            query = query.where(self.model.__table__.columns[column_name] == value)
         entries = await session.execute(query)
         first_entry = entries.first()
 
@@ -157,75 +624,274 @@ class BaseRepository:
         else:
             count = None
         return count
-    
+
+
+    async def _get_count_estimate(self, session: AsyncSession) -> Optional[int]:
+        """
+        None when the table was never analyzed yet (reltuples is -1 on PostgreSQL 14+).
+        A partitioned table has no statistics of its own, its partitions are added up.
+        None as well on other dialects than PostgreSQL.
+        """
+        if session.bind.dialect.name != "postgresql":
+            return None
+        query = text(
+            "SELECT CASE WHEN parent.relkind = 'p' THEN ("
+            "    SELECT CASE WHEN bool_or(child.reltuples < 0) THEN -1 ELSE coalesce(sum(child.reltuples), 0) END"
+            "    FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+            "    WHERE pg_inherits.inhparent = parent.oid"
+            ") ELSE parent.reltuples END::bigint "
+            "FROM pg_class parent WHERE parent.oid = CAST(:table_name AS regclass)"
+        )
+        entries = await session.execute(query, {"table_name": self.model.__tablename__})
+        estimate = entries.scalar()
+        if estimate is None or estimate < 0:
+            return None
+        return estimate
+
+
+    async def _get_count_counter(self, session: AsyncSession) -> int:
+        query = (
+            select(func.coalesce(func.sum(RowCount.delta), 0))
+            .where(RowCount.table_name == self.model.__tablename__)
+        )
+        entries = await session.execute(query)
+        return int(entries.scalar())
+
+
+    @routed(PRIMARY)
+    async def compact_row_counts(self, session: AsyncSession) -> int:
+        """
+        Fold the `row_counts` deltas of the table into one row once there are more than
+        `Config.COUNT_COUNTER_COMPACT_THRESHOLD` of them, so the "counter" sum stays cheap.
+        Commits on its own, see `compact_row_counts_periodically`. Returns the number of
+        folded deltas, 0 on other dialects than PostgreSQL.
+        """
+        if session.bind.dialect.name != "postgresql":
+            return 0
+        table_name = self.model.__tablename__
+
+        # One worker at a time, the others skip the run.
+        query = text("SELECT pg_try_advisory_xact_lock(hashtext(:name))")
+        if not (await session.execute(query, {"name": f"row_counts:{table_name}"})).scalar():
+            await self._commit(session)
+            return 0
+
+        query = select(func.count(RowCount.id)).where(RowCount.table_name == table_name)
+        deltas = (await session.execute(query)).scalar()
+        if deltas > Config.COUNT_COUNTER_COMPACT_THRESHOLD:
+            query = text(
+                "WITH moved AS (DELETE FROM row_counts WHERE table_name = :table_name RETURNING delta) "
+                "INSERT INTO row_counts (table_name, delta) SELECT :table_name, coalesce(sum(delta), 0) FROM moved"
+            )
+            await session.execute(query, {"table_name": table_name})
+        else:
+            deltas = 0
+        await self._commit(session)
+        return deltas
+
 
     async def delete(self, session: AsyncSession, pk: int) -> None:
         query = sqlalchemy_delete(self.model).where(self.model.id == pk)  # NOQA
         await session.execute(query)
-        await session.commit()
+        await self._commit(session, pk)
+
+
+    @routed(PRIMARY)
+    async def delete_where(
+        self, session: AsyncSession,
+        query: QueryBuilder,
+        batch_size: Optional[int] = None,
+        pause_ms: Optional[float] = None,
+        ) -> int:
+        """
+        Delete the entries matching the filters of `query` in batches of `batch_size` rows,
+        each in its own transaction, pausing `pause_ms` in between: locks are held briefly
+        and replicas/vacuum keep up. Returns the number of deleted entries.
+        NOTE: every batch is committed, it can not run inside `unit_of_work`.
+        Example call:
+            ```
+        query = items_repository.query().filter("created_at", "lt", cutoff)
+        deleted = await items_repository.delete_where(session, query)
+            ```
+        """
+        statement = sqlalchemy_delete(self.model)
+        return await self._write_in_batches(session, query, statement, batch_size, pause_ms)
+
+
+    @routed(PRIMARY)
+    async def update_where(
+        self, session: AsyncSession,
+        query: QueryBuilder,
+        batch_size: Optional[int] = None,
+        pause_ms: Optional[float] = None,
+        **kwargs,
+        ) -> int:
+        """
+        Update the entries matching the filters of `query` with `kwargs`, in batches like
+        `delete_where`. Returns the number of updated entries.
+        Example call:
+            ```
+        query = items_repository.query().filter("is_active", "eq", False)
+        updated = await items_repository.update_where(session, query, is_active=True)
+            ```
+        """
+        statement = sqlalchemy_update(self.model).values(**kwargs)
+        return await self._write_in_batches(session, query, statement, batch_size, pause_ms)
+
+
+    async def _write_in_batches(self, session: AsyncSession, query: QueryBuilder, statement,
+                                batch_size: Optional[int], pause_ms: Optional[float]) -> int:
+        if session.info.get(UNIT_OF_WORK_KEY):
+            raise RuntimeError("Improper call inside a unit of work, every batch is committed.")
+        batch_size = batch_size or Config.CHUNKED_WRITE_BATCH_SIZE
+        pause_sec = (Config.CHUNKED_WRITE_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+
+        # Keyset walk over the pk: a batch starts after the last one, so it does not rescan
+        # the rows (or dead tuples) already handled, nor loop over rows still matching after an update.
+        ids = (
+            select(self.model.id)
+            .where(*query.criteria(), self.model.id > bindparam("last_id", type_=self.model.id.type))
+            .order_by(self.model.id)
+            .limit(batch_size)
+        )
+        statement = (
+            statement
+            .where(self.model.id.in_(ids))
+            .returning(self.model.id)
+            .execution_options(synchronize_session=False)
+        )
+
+        params = query.params
+        last_id = uuid.UUID(int=0)
+        total = 0
+        while True:
+            entries = await session.execute(statement, {**params, "last_id": last_id})
+            pks = entries.scalars().all()
+            await self._commit(session, *pks)
+            total += len(pks)
+            if len(pks) < batch_size:
+                return total
+            last_id = max(pks)
+            if pause_sec:
+                await asyncio.sleep(pause_sec)
 
     
-    async def create_with_related(self, session: AsyncSession, *related_fields, **kwargs) -> BaseModel:
+    async def create_with_related(
+        self, session: AsyncSession,
+        *related_fields,
+        loaders: Optional[Mapping[str, str]] = None,
+        **kwargs,
+        ) -> BaseModel:
         """
         Execute insert statement with related entries involved.
         e.g. creation of an employee with assigned role.
+        INSERT ... RETURNING like `create`; the entry is returned with its `related_fields` /
+        `loaders` loaded, see `get_with_related`, the only follow-up queries.
         """
-        query = (
-        sqlalchemy_insert(self.model)
-        .values(**kwargs)
-        .execution_options(synchronize_session="fetch")
-        )
-        result = await session.execute(query)
-        await session.commit()
+        kwargs['id'] = kwargs.get('id') or await self.generate_id()
+        query = sqlalchemy_insert(self.model).returning(self.model)
+        entries = await session.execute(query, [kwargs])
+        entry = entries.scalars().one()
+        await self._commit(session)
 
-        (pk,) = result.inserted_primary_key  # NOQA
+        return await self._load_related(session, entry, related_fields, loaders)
 
-        return await self.get_with_related(session, pk, *related_fields)
 
+    async def update_with_related(
+        self, session: AsyncSession,
+        pk: int,
+        *related_fields,
+        loaders: Optional[Mapping[str, str]] = None,
+        **kwargs,
+        ) -> BaseModel:
+        """
+        UPDATE ... RETURNING like `update`; the entry is returned with its `related_fields` /
+        `loaders` loaded, see `get_with_related`, the only follow-up queries.
+        """
+        entry = await self.update(session, pk, **kwargs)
+        if entry is None:
+            return None
+        return await self._load_related(session, entry, related_fields, loaders)
 
-    async def update_with_related(self, session: AsyncSession, pk: int, *related_fields, **kwargs) -> BaseModel:
-        query = (
-        sqlalchemy_update(self.model)
-        .where(self.model.id == pk)  # NOQA
-        .values(**kwargs)
-        .execution_options(synchronize_session="fetch")
-        )
-        await session.execute(query)
-        await session.commit()
 
-        return await self.get_with_related(session, pk, *related_fields)
+    async def _load_related(
+        self, session: AsyncSession,
+        entry: BaseModel,
+        related_fields: Sequence,
+        loaders: Optional[Mapping[str, str]],
+        ) -> BaseModel:
+        if not loader_spec(related_fields, loaders):
+            return entry
+        # Read-your-writes: the session wrote, the query goes to the primary.
+        return await self.get_with_related(session, entry.id, related_fields=related_fields, loaders=loaders)
 
 
+    @routed(REPLICA)
     async def get_with_related(
         self, session: AsyncSession,
         pk: int,
         related_fields: Optional[Sequence] = (),
         nested_related_fields: Optional[Sequence[Sequence]] = (),
+        loaders: Optional[Mapping[str, str]] = None,
     ) -> BaseModel:
-        query = select(self.model).where(self.model.id == pk) # NOQA
+        """
+        Get an entry with related entries loaded. `related_fields` are relationship
+        attributes or dotted paths (`nested_related_fields` are paths as sequences of
+        attributes, of any depth), loaded with the "auto" strategy: "selectin" for
+        collections, "joined" otherwise. `loaders` chooses the strategy of each path,
+        see `loader_spec`.
+        Example call:
+            ```
+        entry = await self.get_with_related(
+            session, pk,
+            related_fields=[Employee.role],
+            loaders={"projects": "selectin", "projects.tasks.assignee": "joined", "*": "raise"},
+        )
+            ```
+        """
+        spec = loader_spec((*related_fields, *nested_related_fields), loaders)
+        if self.cache is not None and not spec:
+            # Only plain entries are cached, relationships are not.
+            return await self.get(session, pk)
 
-        for related_field in related_fields:
-            query = query.options(joinedload(related_field))
-
-        for nested_rel_field in nested_related_fields:
-            if len(nested_rel_field) == 2:
-                query = query.options(contains_eager(nested_rel_field[0],
-                                                    nested_rel_field[1]))
-            elif len(nested_rel_field) == 3:
-                query = query.options(contains_eager(nested_rel_field[0],
-                                                    nested_rel_field[1],
-                                                    nested_rel_field[2]))
-            else:
-                # NOTE: len -> rel_field's number, dynamically:
-                #  `foo, bar, *other = funct()` -> go recursively till all unpacked
-                raise RuntimeError("Nesting level too deep.")
+        query = select(self.model).where(self.model.id == pk) # NOQA
+        if spec:
+            query = query.options(*loader_options(self.model, spec))
 
         entries = await session.execute(query)
-        first_entry = entries.first()
+        # Joined collections repeat the parent row.
+        return entries.unique().scalars().first()
 
-        if first_entry:
-            (entry,) = first_entry
-        else:
-            entry = None
 
-        return entry
\ No newline at end of file
+    @routed(REPLICA)
+    async def get_list_with_related(
+        self, session: AsyncSession,
+        related_fields: Sequence = (),
+        loaders: Optional[Mapping[str, str]] = None,
+        query: Optional[QueryBuilder] = None,
+        ):
+        """
+        Get a list of entries (all of them, or the ones of `query`) with their related
+        entries loaded in batches: a fixed number of queries whatever the number of entries.
+        Example call:
+            ```
+        entries = await self.get_list_with_related(
+            session, related_fields=["children"], query=self.query().paginate(limit=50),
+        )
+            ```
+        """
+        query = query or self.query()
+        return await self.get_list(session, query.load(related_fields, loaders))
+
+
+async def compact_row_counts_periodically(repository: BaseRepository,
+                                          interval_sec: float = Config.COUNT_COUNTER_COMPACT_INTERVAL_SEC) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            async with AsyncSessionLocal() as session:
+                folded = await repository.compact_row_counts(session)
+            if folded:
+                logger.info(f"Compacted {folded} '{repository.model.__tablename__}' row count deltas.")
+        except SQLAlchemyError:
+            logger.exception(f"Failed to compact the '{repository.model.__tablename__}' row count deltas.")
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    In-process buffer that collects rows of a repository model and writes them in batches
+    through `BaseRepository.bulk_create`.
+
+    A batch is flushed once it holds `max_rows` rows or `max_delay_ms` passed since
+    its first row was added, whichever comes first. With `wait_for_flush` callers of
+    `add` are resumed once their batch is committed (or get its exception),
+    otherwise `add` returns right away and failures are only logged.
+    """
+
+    def __init__(self,
+                 repository,
+                 session_factory=None,
+                 max_rows: int = Config.INGEST_BUFFER_MAX_ROWS,
+                 max_delay_ms: int = Config.INGEST_BUFFER_MAX_DELAY_MS,
+                 wait_for_flush: bool = Config.INGEST_BUFFER_WAIT_FOR_FLUSH,
+                 flush_method: str = Config.INGEST_BUFFER_FLUSH_METHOD,
+                 max_concurrent_flushes: int = Config.INGEST_BUFFER_MAX_CONCURRENT_FLUSHES):
+        if flush_method not in ("insert", "copy"):
+            raise RuntimeError(f"Improper flush method '{flush_method}'.")
+
+        if session_factory is None:
+            from db import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+
+        self.repository = repository
+        self.session_factory = session_factory
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.wait_for_flush = wait_for_flush
+        self.flush_method = flush_method
+        self.max_concurrent_flushes = max_concurrent_flushes
+
+        self._rows: List[dict] = []
+        self._futures: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks = set()
+        self._flush_semaphore: Optional[asyncio.Semaphore] = None
+
+
+    async def add(self, row: dict) -> None:
+        """
+        Queue a row for insertion.
+        """
+        loop = asyncio.get_running_loop()
+        future = None
+        if self.wait_for_flush:
+            future = loop.create_future()
+            self._futures.append(future)
+        self._rows.append(row)
+
+        if len(self._rows) >= self.max_rows:
+            self.flush_nowait()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self.flush_nowait)
+
+        if future is not None:
+            # Shield, so a cancelled request does not cancel the write of the whole batch.
+            await asyncio.shield(future)
+
+
+    def flush_nowait(self) -> None:
+        """
+        Detach the pending rows and write them in a background task.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._rows:
+            return
+
+        rows, futures = self._rows, self._futures
+        self._rows, self._futures = [], []
+
+        task = asyncio.get_running_loop().create_task(self._flush(rows, futures))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+
+    async def close(self) -> None:
+        """
+        Write the pending rows and wait for all in-flight flushes, e.g. on shutdown.
+        """
+        self.flush_nowait()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+
+    async def _flush(self, rows: List[dict], futures: List[asyncio.Future]) -> None:
+        if self._flush_semaphore is None:
+            self._flush_semaphore = asyncio.Semaphore(self.max_concurrent_flushes)
+
+        try:
+            async with self._flush_semaphore:
+                async with self.session_factory() as session:
+                    await self.repository.bulk_create(
+                        session, rows, use_copy=self.flush_method == "copy",
+                    )
+        except Exception as exc:
+            table_name = self.repository.model.__tablename__
+            logger.exception(f"Failed to flush {len(rows)} buffered '{table_name}' rows.")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import Config
+
+
+# All repository caches by name, see `get_cache_stats`.
+caches: Dict[str, "RepositoryCache"] = {}
+
+
+class LRUCache:
+    """
+    Bounded in-process LRU mapping with a per-entry TTL.
+    """
+
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        item = self._entries.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_sec: Optional[float] = None) -> None:
+        ttl_sec = self.ttl_sec if ttl_sec is None else ttl_sec
+        self._entries[key] = (time.monotonic() + ttl_sec, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CacheBackend(ABC):
+    """
+    Shared cache backend interface (e.g. redis, memcached), so workers share entries.
+    Values are plain dicts of column values, serialization is up to the backend.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: dict, ttl_sec: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        ...
+
+
+class LocalCacheBackend(CacheBackend):
+    """
+    In-process stand-in of a shared backend, e.g. for tests and single worker setups.
+    """
+
+    def __init__(self, max_size: int = Config.CACHE_MAX_SIZE):
+        self._cache = LRUCache(max_size=max_size, ttl_sec=Config.CACHE_TTL_SEC)
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: dict, ttl_sec: float) -> None:
+        self._cache.set(key, value, ttl_sec)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._cache.delete(key)
+
+
+class RepositoryCache:
+    """
+    Read-through cache of repository entries: an in-process LRU in front of an
+    optional shared backend. Concurrent misses of the same key are coalesced
+    into a single load.
+    NOTE: invalidation only reaches the local LRU of the current worker and the
+    shared backend, keep the TTL short when running several workers.
+    """
+
+    def __init__(self,
+                 name: str,
+                 max_size: int = Config.CACHE_MAX_SIZE,
+                 ttl_sec: float = Config.CACHE_TTL_SEC,
+                 backend: Optional[CacheBackend] = None):
+        self.name = name
+        self.ttl_sec = ttl_sec
+        self.backend = backend
+        self.local = LRUCache(max_size=max_size, ttl_sec=ttl_sec)
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Keys invalidated while being loaded, their loaded value may be stale.
+        self._stale_loads = set()
+        caches[name] = self
+
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        """
+        Return the cached value of `key`, calling `loader` on a miss.
+        `None` results are not cached.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            self.coalesced += 1
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await self._load(key, loader)
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark retrieved, nobody may be waiting for it.
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            self._loading.pop(key, None)
+            self._stale_loads.discard(key)
+        return value
+
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        if self.backend is not None:
+            value = await self.backend.get(key)
+            if value is not None:
+                self.backend_hits += 1
+                self.local.set(key, value)
+                return value
+
+        self.misses += 1
+        value = await loader()
+        if value is not None and key not in self._stale_loads:
+            self.local.set(key, value)
+            if self.backend is not None:
+                await self.backend.set(key, value, self.ttl_sec)
+        return value
+
+
+    async def invalidate(self, *keys: str) -> None:
+        for key in keys:
+            self.local.delete(key)
+            if key in self._loading:
+                self._stale_loads.add(key)
+        self.invalidations += len(keys)
+        if self.backend is not None:
+            await self.backend.delete(*keys)
+
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.local),
+            "hits": self.hits,
+            "backend_hits": self.backend_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.local.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def get_cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in caches.items()}
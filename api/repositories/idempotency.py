@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, NamedTuple, Tuple
+
+from sqlalchemy import update as sqlalchemy_update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import Config
+from db import AsyncSessionLocal
+from api.metrics import IDEMPOTENCY_REQUESTS
+from api.models import IdempotencyKey
+from api.repositories.base import BaseRepository, UNIT_OF_WORK_KEY, unit_of_work
+from api.repositories.cache import LRUCache
+from exceptions import IdempotencyKeyInProgress, IdempotencyKeyInvalid, IdempotencyKeyMismatch
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+# INSERT ... ON CONFLICT DO NOTHING by dialect
+_DIALECT_INSERTS = {
+    "postgresql": postgresql_insert,
+    "sqlite": sqlite_insert,
+}
+
+# Stored response: request hash, status code, response body
+StoredResponse = Tuple[str, int, dict]
+
+
+class IdempotentResponse(NamedTuple):
+    status_code: int
+    response: dict
+    # True when the response is the one of an earlier request with the same key.
+    replayed: bool
+
+
+class IdempotencyRepository(BaseRepository):
+    """
+    Run a request once per client and `Idempotency-Key`, replaying its response to retries.
+    - Recent responses are kept in an in-process LRU, per worker.
+    - A duplicate arriving while the first request is running in this worker waits
+      for its result instead of doing the work again.
+    - The key is inserted in the transaction of the request, before the work. The unique
+      index lets a single transaction per key commit, across workers: on PostgreSQL a
+      duplicate insert waits for the first transaction and then finds its response.
+    NOTE: the key and the writes of the request are committed together, unless the
+    writes go through the write-behind buffer (`Config.INGEST_BUFFER_ENABLED`).
+    """
+
+    def __init__(self,
+                 max_size: int = Config.IDEMPOTENCY_CACHE_MAX_SIZE,
+                 ttl_sec: float = Config.IDEMPOTENCY_TTL_SEC):
+        super().__init__()
+        self.model = IdempotencyKey
+        self.ttl_sec = ttl_sec
+        self.responses = LRUCache(max_size=max_size, ttl_sec=ttl_sec)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+
+    async def run(
+        self, session: AsyncSession,
+        client: str,
+        key: str,
+        request_hash: str,
+        handler: Callable[[], Awaitable[Tuple[int, dict]]],
+        ) -> IdempotentResponse:
+        """
+        Return the stored response of (`client`, `key`), or call `handler` for the
+        status code and JSON response of the request and store them.
+        Commits on its own: the writes of `handler` join the transaction of the key.
+        Example call:
+            ```
+        async def handler():
+            return 200, await items_repository.process_data(session, data)
+
+        result = await idempotency_repository.run(session, client, key, payload_hash(data), handler)
+            ```
+        """
+        if session.info.get(UNIT_OF_WORK_KEY):
+            raise RuntimeError("Improper call inside a unit of work, the key has to be committed with the request.")
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            raise IdempotencyKeyInvalid(f"Improper Idempotency-Key, 1 to {MAX_KEY_LENGTH} characters are expected.")
+
+        cache_key = f"{client}\n{key}"
+        stored = self.responses.get(cache_key)
+        if stored is not None:
+            return self._replay(stored, request_hash, outcome="replayed_local")
+
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            return self._replay(await asyncio.shield(in_flight), request_hash, outcome="coalesced")
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        try:
+            stored, replayed = await self._run_once(session, client, key, request_hash, handler)
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark retrieved, nobody may be waiting for it.
+            future.exception()
+            raise
+        else:
+            future.set_result(stored)
+        finally:
+            self._in_flight.pop(cache_key, None)
+
+        self.responses.set(cache_key, stored)
+        if replayed:
+            return self._replay(stored, request_hash, outcome="replayed")
+        IDEMPOTENCY_REQUESTS.inc(outcome="executed")
+        return IdempotentResponse(stored[1], stored[2], replayed=False)
+
+
+    async def _run_once(
+        self, session: AsyncSession,
+        client: str,
+        key: str,
+        request_hash: str,
+        handler: Callable[[], Awaitable[Tuple[int, dict]]],
+        ) -> Tuple[StoredResponse, bool]:
+        dialect_name = session.bind.dialect.name
+        if dialect_name not in _DIALECT_INSERTS:
+            raise RuntimeError(f"Improper dialect '{dialect_name}' for idempotency keys.")
+
+        async with unit_of_work(session):
+            query = _DIALECT_INSERTS[dialect_name](self.model).values(
+                id=await self.generate_id(), client=client, key=key, request_hash=request_hash,
+            ).on_conflict_do_nothing(index_elements=["client", "key"]).returning(self.model.id)
+            pk = (await session.execute(query)).scalar()
+
+            if pk is None:
+                # The key was committed by an earlier request.
+                query = select(self.model.request_hash, self.model.status_code, self.model.response).where(
+                    self.model.client == client, self.model.key == key,
+                )
+                row = (await session.execute(query)).one()
+                if row.status_code is None:
+                    IDEMPOTENCY_REQUESTS.inc(outcome="in_progress")
+                    raise IdempotencyKeyInProgress()
+                return (row.request_hash, row.status_code, row.response), True
+
+            status_code, response = await handler()
+            await session.execute(
+                sqlalchemy_update(self.model)
+                .where(self.model.id == pk)
+                .values(status_code=status_code, response=response)
+            )
+        return (request_hash, status_code, response), False
+
+
+    @staticmethod
+    def _replay(stored: StoredResponse, request_hash: str, outcome: str) -> IdempotentResponse:
+        if stored[0] != request_hash:
+            IDEMPOTENCY_REQUESTS.inc(outcome="mismatch")
+            raise IdempotencyKeyMismatch()
+        IDEMPOTENCY_REQUESTS.inc(outcome=outcome)
+        return IdempotentResponse(stored[1], stored[2], replayed=True)
+
+
+    async def delete_expired(self, session: AsyncSession) -> int:
+        """
+        Delete the keys older than `ttl_sec`, return their number.
+        """
+        query = self.query().filter("created_at", "lt", datetime.utcnow() - timedelta(seconds=self.ttl_sec))
+        return await self.delete_where(session, query)
+
+
+async def purge_expired_keys_periodically(repository: IdempotencyRepository,
+                                          interval_sec: float = Config.IDEMPOTENCY_PURGE_INTERVAL_SEC) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            async with AsyncSessionLocal() as session:
+                deleted = await repository.delete_expired(session)
+            if deleted:
+                logger.info(f"Purged {deleted} expired idempotency keys.")
+        except SQLAlchemyError:
+            logger.exception("Failed to purge the expired idempotency keys.")
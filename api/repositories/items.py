@@ -1,79 +1,200 @@
+from config import Config
 from api.models import Items
 from api.utils import generate_ping_id
 from api.repositories.base import BaseRepository
+from api.repositories.buffer import WriteBehindBuffer
+from api.repositories.cache import RepositoryCache
+from api.repositories.jobs import JobQueue
+from api.repositories.partitions import MonthlyPartitions
+from typing import List, Optional, Tuple
 from sqlalchemy import select, cast, Uuid
 from sqlalchemy.ext.asyncio import AsyncSession
 from api.schemas import ItemsSchema
+from pydantic import ValidationError
+
+
+ENRICH_ITEMS_JOB = "items.enrich"
+# Items per enrichment job, a batch is spread over the job workers.
+ENRICH_ITEMS_PER_JOB = 100
 
 
 class ItemsRepository(BaseRepository):
-    def __init__(self):
+    """
+    NOTE: a single instance is shared by all concurrent requests, so the ingestion
+    pipeline keeps per-request data in local variables only, never on `self`.
+    """
+
+    keyset_sort_columns = ("created_at", "item_id", "id")
+
+    def __init__(self, job_queue: Optional[JobQueue] = None):
         super().__init__()
         self.model = Items
-        self.item_id = None
-        self.title = None
-        self.description = None
-        self.is_active = False
-        self.items_number = None
-        self.data = None
-        # self.vertical_fields = []
-        self.ping_log = None
-
-    
-    async def process_data(self, session: AsyncSession, data: dict) -> dict:
-        self.session = session
-        self.item_id = generate_ping_id()
-        self.data = data['data']
-
-        ping_log_payload_data = ItemsSchema(
-            item_id=self.item_id,
-            ip_address=data['data']['ip_address'],
-            is_active=False,
-            title=data['data']['title'],
-            description=data['data']['description'],
-            items_number=data['data']['items_number'],
-        ).dict()
-
-    
-        # Check if items_number exists
-        if not self.data.get('title'):
-            response_data = {
-                "result": "failed",
-                "price": 0.00,
-                "message": "Invalid Request",
-                "errors": [
-                    {
-                        "error": "Missing Items title or description."
-                    }
-                ]
-            }
-            ping_log_payload_data.update({
-                'response': response_data
-            })
-            ping_log_payload = ItemsSchema(**ping_log_payload_data)
-            # self.ping_log = await self.create(self.session, **ping_log_payload.dict())
-            return response_data
-        
-
-        # If everything's allright, save and respond to seller
-        # TODO: Calculate and update data on previous steps completion
-        ping_log_payload_data.update({
-            'item_accepted': True,
-        })
-        ItemsSchema(**ping_log_payload_data) # Validate
-
-        response_data = {
+        # Enrichment runs after the response when set, inline otherwise, see `Config.JOBS_*`
+        self.job_queue = job_queue
+        if job_queue is not None:
+            job_queue.register(ENRICH_ITEMS_JOB, self.enrich_items)
+        # Opt-in batched ingestion, see `Config.INGEST_BUFFER_*`
+        self.write_buffer = WriteBehindBuffer(self) if Config.INGEST_BUFFER_ENABLED else None
+        self.cache = RepositoryCache(self.model.__tablename__) if Config.CACHE_ENABLED else None
+        # Monthly partitions and retention, see `Config.PARTITION_*` / `Config.ITEMS_RETENTION_*`
+        self.partitions = MonthlyPartitions(
+            self, retention_days=Config.ITEMS_RETENTION_DAYS, retention_mode=Config.ITEMS_RETENTION_MODE,
+        )
+
+
+    async def process_data(self, session: AsyncSession, data: dict, ip_address: Optional[str] = None) -> dict:
+        """
+        Ingestion pipeline of a single item: validate -> enrich -> persist -> respond.
+        With a job queue the enrichment runs once the item is committed, off the request path.
+        """
+        item_id = generate_ping_id()
+
+        item, errors = self.validate_item(item_id, data, ip_address)
+        if errors:
+            return self.rejected_response(errors)
+
+        enrichment = None
+        if self.job_queue is None:
+            enrichment = await self.enrich_item(session, item)
+            item = item.copy(update=enrichment)
+        await self.persist_item(session, item)
+        await self.enqueue_enrichment(session, [item])
+        return self.accepted_response(item, enrichment)
+
+
+    async def process_batch(self, session: AsyncSession, data: list, ip_address: Optional[str] = None) -> dict:
+        """
+        Run a batch of items through the same pipeline as `process_data`,
+        saving the accepted ones at once.
+        """
+        items = []
+        responses = []
+        for item_data in data:
+            if not isinstance(item_data, dict):
+                responses.append(self.rejected_response(["Item must be an object."]))
+                continue
+
+            item, errors = self.validate_item(generate_ping_id(), item_data, ip_address)
+            if errors:
+                responses.append(self.rejected_response(errors))
+                continue
+
+            enrichment = None
+            if self.job_queue is None:
+                enrichment = await self.enrich_item(session, item)
+                item = item.copy(update=enrichment)
+            items.append(item)
+            responses.append(self.accepted_response(item, enrichment))
+
+        await self.bulk_create(session, [self.item_row(item) for item in items])
+        await self.enqueue_enrichment(session, items)
+
+        return {
             "result": "Success",
-            "item_id": self.item_id,
+            "accepted": len(items),
+            "rejected": len(responses) - len(items),
+            "items": responses,
+        }
+
+
+    def validate_item(self, item_id: str, data: dict, ip_address: Optional[str] = None) -> Tuple[Optional[ItemsSchema], List[str]]:
+        """
+        Validate a single incoming item, once, into the typed object used by the next steps.
+        Returns the item and the list of errors (the item is None when there are any).
+        """
+        # Check if title exists
+        if not data.get('title'):
+            return None, ["Missing Items title or description."]
+
+        try:
+            item = ItemsSchema(
+                item_id=item_id,
+                ip_address=ip_address,
+                is_active=False,
+                title=data.get('title'),
+                description=data.get('description'),
+                items_number=data.get('items_number'),
+            )
+        except ValidationError as e:
+            return None, [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()]
+        return item, []
+
+
+    @staticmethod
+    def item_row(item: ItemsSchema) -> dict:
+        """
+        Column values of a validated item. Unset values are left out so column defaults (e.g. `created_at`) apply.
+        """
+        return item.dict(exclude_none=True)
+
+
+    async def enrich_item(self, session: AsyncSession, item: ItemsSchema) -> dict:
+        """
+        Calculate the data of an accepted item, column values stored with the item.
+        """
+        # Placeholder price until the enrichment rules exist.
+        return {
             "price": 0.00,
+        }
+
+
+    async def enqueue_enrichment(self, session: AsyncSession, items: List[ItemsSchema]) -> None:
+        if self.job_queue is None:
+            return
+        item_ids = [item.item_id for item in items]
+        for start in range(0, len(item_ids), ENRICH_ITEMS_PER_JOB):
+            await self.job_queue.enqueue_after_commit(
+                session, ENRICH_ITEMS_JOB, item_ids=item_ids[start:start + ENRICH_ITEMS_PER_JOB],
+            )
+
+
+    async def enrich_items(self, session: AsyncSession, item_ids: List[str]) -> None:
+        """
+        Enrichment job of accepted items, their enrichment is stored on them.
+        """
+        # One SELECT for the batch, on the primary as jobs run inside a unit of work.
+        entries = await self.get_list(session, self.query().filter("item_id", "in", item_ids))
+        missing = set(item_ids) - {entry.item_id for entry in entries}
+        if missing:
+            # Not written yet, e.g. still in the write-behind buffer: the job is retried.
+            raise RuntimeError(f"Non-existing items {sorted(missing)}.")
+
+        enrichments = []
+        for entry in entries:
+            enrichment = await self.enrich_item(session, ItemsSchema.from_orm(entry))
+            enrichments.append({"id": entry.id, **enrichment})
+        # One executemany UPDATE for the batch.
+        await self.bulk_update(session, enrichments)
+
+
+    async def persist_item(self, session: AsyncSession, item: ItemsSchema) -> None:
+        if self.write_buffer is not None:
+            await self.write_buffer.add(self.item_row(item))
+        else:
+            await self.create(session, **self.item_row(item))
+
+
+    @staticmethod
+    def accepted_response(item: ItemsSchema, enrichment: Optional[dict]) -> dict:
+        return {
+            "result": "Success",
+            "item_id": item.item_id,
+            # None while the enrichment is pending, see `GET /api/items/{item_id}`.
+            "price": enrichment['price'] if enrichment is not None else None,
             "message": "Item accept",
         }
-        
-        ping_log_payload_data.update({
-            'response': response_data,
-        })
-        ping_log_payload = ItemsSchema(**ping_log_payload_data) # Validate
-        self.ping_log = await self.create(self.session, **ping_log_payload.dict())
-        return response_data
-
-        
\ No newline at end of file
+
+
+    @staticmethod
+    def rejected_response(errors: List[str]) -> dict:
+        return {
+            "result": "failed",
+            "price": 0.00,
+            "message": "Invalid Request",
+            "errors": [
+                {
+                    "error": error
+                }
+                for error in errors
+            ]
+        }
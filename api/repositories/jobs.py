@@ -0,0 +1,390 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import update as sqlalchemy_update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from config import Config
+from db import PRIMARY, routed
+from api.metrics import JOB_DURATION, JOBS_PROCESSED
+from api.models import Job
+from api.repositories.base import AFTER_COMMIT_KEY, BaseRepository, UNIT_OF_WORK_KEY, unit_of_work
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("memory", "database")
+PENDING = "pending"
+FAILED = "failed"
+
+# All job queues by name, see `get_job_stats`.
+queues: Dict[str, "JobQueue"] = {}
+
+# Called with a session (inside a unit of work) and the job payload as keyword arguments.
+JobHandler = Callable[..., Awaitable[None]]
+
+
+class QueuedJob:
+    """
+    A job taken by a worker: `id` is the row of the database backend, None in memory.
+    """
+    __slots__ = ("id", "name", "payload", "attempts")
+
+    def __init__(self, id, name: str, payload: dict, attempts: int = 0):
+        self.id = id
+        self.name = name
+        self.payload = payload
+        self.attempts = attempts
+
+
+class JobsRepository(BaseRepository):
+    """
+    Storage of the "database" backend of `JobQueue`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.model = Job
+
+
+    async def enqueue(self, session: AsyncSession, name: str, payload: dict) -> None:
+        """
+        Insert a pending job, committed with the unit of work when inside one.
+        """
+        await self.create(session, name=name, payload=payload, status=PENDING)
+
+
+    @routed(PRIMARY)
+    async def claim(self, session: AsyncSession, limit: int, lease_sec: float) -> List[QueuedJob]:
+        """
+        Claim up to `limit` due jobs in a single statement: their `run_at` is pushed by the
+        lease and their attempts counted. SKIP LOCKED lets concurrent workers claim other
+        jobs instead of waiting for each other (PostgreSQL, other dialects leave it out).
+        """
+        now = datetime.utcnow()
+        due = (
+            select(self.model.id)
+            .where(self.model.status == PENDING, self.model.run_at <= now)
+            .order_by(self.model.run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        query = (
+            sqlalchemy_update(self.model)
+            .where(self.model.id.in_(due))
+            .values(run_at=now + timedelta(seconds=lease_sec), attempts=self.model.attempts + 1)
+            .returning(self.model.id, self.model.name, self.model.payload, self.model.attempts)
+            .execution_options(synchronize_session=False)
+        )
+        rows = (await session.execute(query)).all()
+        await self._commit(session)
+        return [QueuedJob(row.id, row.name, row.payload, row.attempts) for row in rows]
+
+
+    async def complete(self, session: AsyncSession, pk) -> None:
+        await self.delete(session, pk)
+
+
+    async def retry(self, session: AsyncSession, pk, delay_sec: float, error: str) -> None:
+        await self.update(session, pk, run_at=datetime.utcnow() + timedelta(seconds=delay_sec), last_error=error)
+
+
+    async def fail(self, session: AsyncSession, pk, error: str) -> None:
+        await self.update(session, pk, status=FAILED, last_error=error)
+
+
+    async def release(self, session: AsyncSession, pks: List) -> None:
+        """
+        Give claimed jobs back without counting an attempt, e.g. on shutdown.
+        """
+        query = (
+            sqlalchemy_update(self.model)
+            .where(self.model.id.in_(pks))
+            .values(run_at=datetime.utcnow(), attempts=self.model.attempts - 1)
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(query)
+        await self._commit(session, *pks)
+
+
+class JobQueue:
+    """
+    In-process queue of follow-up work, run by `concurrency` worker tasks after the response.
+    - Handlers are registered by job name, see `register`, and get a session inside a
+      unit of work: their repository writes are committed once the job succeeds.
+    - A failed run is retried after an exponential backoff with jitter, `max_attempts`
+      runs at most, then logged and given up on.
+    - Backends: "memory" keeps the jobs in this worker process, lost on restart.
+      "database" stores them in the `jobs` table in the transaction of the enqueuing
+      request: `batch_size` due jobs are claimed per query, by any worker process, and a
+      job whose worker died is claimed again once its lease (`lease_sec`) runs out.
+    NOTE: a job can run more than once (a retry after a commit failure, an expired lease),
+    handlers should be idempotent.
+    """
+
+    def __init__(self,
+                 repository: Optional[JobsRepository] = None,
+                 name: str = "default",
+                 backend: str = Config.JOBS_BACKEND,
+                 session_factory=None,
+                 concurrency: int = Config.JOBS_CONCURRENCY,
+                 batch_size: int = Config.JOBS_BATCH_SIZE,
+                 poll_interval_ms: float = Config.JOBS_POLL_INTERVAL_MS,
+                 lease_sec: float = Config.JOBS_LEASE_SEC,
+                 max_attempts: int = Config.JOBS_MAX_ATTEMPTS,
+                 backoff_base_ms: float = Config.JOBS_BACKOFF_BASE_MS,
+                 backoff_max_ms: float = Config.JOBS_BACKOFF_MAX_MS,
+                 max_queue: int = Config.JOBS_MAX_QUEUE):
+        if backend not in BACKENDS:
+            raise RuntimeError(f"Improper jobs backend '{backend}'.")
+        if backend == "database" and repository is None:
+            raise RuntimeError("Improper jobs backend 'database' without a repository.")
+
+        if session_factory is None:
+            from db import AsyncSessionLocal
+            session_factory = AsyncSessionLocal
+
+        self.repository = repository
+        self.name = name
+        self.backend = backend
+        self.session_factory = session_factory
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = max(batch_size, 1)
+        self.poll_interval = poll_interval_ms / 1000
+        self.lease_sec = lease_sec
+        self.max_attempts = max(max_attempts, 1)
+        self.backoff_base = backoff_base_ms / 1000
+        self.backoff_max = backoff_max_ms / 1000
+        self.max_queue = max_queue
+
+        self.handlers: Dict[str, JobHandler] = {}
+        self.processed: Dict[str, int] = {}
+
+        self._ready: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._workers: List[asyncio.Task] = []
+        self._running = set()
+        self._delayed = set()
+        queues[name] = self
+
+
+    def register(self, name: str, handler: JobHandler) -> None:
+        """
+        Run `handler(session, **payload)` for the jobs named `name`.
+        """
+        self.handlers[name] = handler
+
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+
+    def start(self) -> None:
+        """
+        Start the workers (and the claiming of the database backend), e.g. on startup.
+        """
+        if self.started:
+            return
+        if self._ready is None:
+            # Jobs enqueued before the start are kept.
+            self._ready = asyncio.Queue(maxsize=self.max_queue if self.backend == "memory" else 0)
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.concurrency)]
+        if self.backend == "database":
+            self._dispatcher = loop.create_task(self._dispatch())
+
+
+    async def enqueue_after_commit(self, session: AsyncSession, job_name: str, **payload) -> None:
+        """
+        Run the `job_name` job with `payload` (JSON types) once the writes of the session
+        are committed: when the current unit of work commits, right away outside of one.
+        Nothing runs if the unit of work is rolled back.
+        With the database backend the job row is inserted in the same transaction.
+        Example call:
+            ```
+        async with unit_of_work(session):
+            entry = await repository.create(session, **data)
+            await job_queue.enqueue_after_commit(session, "items.enrich", item_ids=[entry.item_id])
+            ```
+        """
+        if job_name not in self.handlers:
+            raise RuntimeError(f"Non-existing job '{job_name}'.")
+
+        if self.backend == "database":
+            await self.repository.enqueue(session, job_name, payload)
+
+            async def after_commit():
+                if self._wakeup is not None:
+                    self._wakeup.set()
+        else:
+            job = QueuedJob(None, job_name, payload)
+
+            async def after_commit():
+                self._put(job)
+
+        if session.info.get(UNIT_OF_WORK_KEY):
+            session.info.setdefault(AFTER_COMMIT_KEY, []).append(after_commit)
+        else:
+            await after_commit()
+
+
+    def _put(self, job: QueuedJob) -> None:
+        self._delayed.discard(job)
+        if self._ready is None:
+            self._ready = asyncio.Queue(maxsize=self.max_queue)
+        try:
+            self._ready.put_nowait(job)
+        except asyncio.QueueFull:
+            self._count(job.name, "dropped")
+            logger.error(f"Dropped the '{job.name}' job, {self.max_queue} jobs are queued already.")
+
+
+    def backoff(self, attempts: int) -> float:
+        """
+        Seconds before the next run after `attempts` failed runs: exponential, capped,
+        half of it random so retries of jobs failing together spread out.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+    async def _dispatch(self) -> None:
+        """
+        Claim due jobs of the database backend in batches, once the claimed ones are taken.
+        Idle, poll every `poll_interval` or when a job is enqueued by this process.
+        """
+        while True:
+            self._wakeup.clear()
+            if not self._ready.empty():
+                # Claimed jobs wait locally, their lease is running: claim no more for now.
+                await self._wakeup.wait()
+                continue
+
+            try:
+                async with self.session_factory() as session:
+                    jobs = await self.repository.claim(session, self.batch_size, self.lease_sec)
+            except SQLAlchemyError:
+                logger.exception(f"Failed to claim '{self.name}' jobs.")
+                jobs = []
+            for job in jobs:
+                self._ready.put_nowait(job)
+
+            if len(jobs) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._ready.get()
+            if self._ready.empty():
+                self._wakeup.set()
+            task = asyncio.get_running_loop().create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            # Shield, so stopping the workers lets the running jobs finish, see `close`.
+            await asyncio.shield(task)
+
+
+    async def _run(self, job: QueuedJob) -> None:
+        if job.id is None:
+            job.attempts += 1
+        started = time.perf_counter()
+        try:
+            handler = self.handlers.get(job.name)
+            if handler is None:
+                raise RuntimeError(f"Non-existing job '{job.name}'.")
+            async with self.session_factory() as session:
+                async with unit_of_work(session):
+                    await handler(session, **job.payload)
+                    if job.id is not None:
+                        await self.repository.complete(session, job.id)
+        except Exception as exc:
+            await self._retry_or_fail(job, exc)
+        else:
+            self._count(job.name, "done")
+        finally:
+            JOB_DURATION.observe(time.perf_counter() - started, job=job.name)
+
+
+    async def _retry_or_fail(self, job: QueuedJob, exc: Exception) -> None:
+        error = f"{type(exc).__name__}: {exc}"
+        if job.attempts >= self.max_attempts:
+            self._count(job.name, "failed")
+            logger.error(f"Job '{job.name}' failed after {job.attempts} attempts: {error}", exc_info=exc)
+            if job.id is not None:
+                await self._store(self.repository.fail, job.id, error)
+            return
+
+        delay = self.backoff(job.attempts)
+        self._count(job.name, "retried")
+        logger.warning(f"Job '{job.name}' failed (attempt {job.attempts}), retrying in {delay:.2f}s: {error}")
+        if job.id is not None:
+            await self._store(self.repository.retry, job.id, delay, error)
+        else:
+            self._delayed.add(job)
+            asyncio.get_running_loop().call_later(delay, self._put, job)
+
+
+    async def _store(self, method, *args) -> None:
+        try:
+            async with self.session_factory() as session:
+                await method(session, *args)
+        except SQLAlchemyError:
+            # The job is claimed again once its lease runs out.
+            logger.exception("Failed to store the outcome of a job.")
+
+
+    def _count(self, job_name: str, outcome: str) -> None:
+        key = f"{job_name}:{outcome}"
+        self.processed[key] = self.processed.get(key, 0) + 1
+        JOBS_PROCESSED.inc(job=job_name, outcome=outcome)
+
+
+    async def close(self, timeout_sec: float = Config.JOBS_SHUTDOWN_TIMEOUT_SEC) -> None:
+        """
+        Stop taking jobs and give the running ones `timeout_sec` to finish, e.g. on shutdown.
+        Claimed jobs which did not start are given back, queued memory jobs are lost.
+        """
+        tasks = [task for task in (self._dispatcher, *self._workers) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher, self._workers = None, []
+        if self._running:
+            await asyncio.wait(self._running, timeout=timeout_sec)
+
+        pending = []
+        while self._ready is not None and not self._ready.empty():
+            pending.append(self._ready.get_nowait())
+        if self.backend == "database":
+            if pending:
+                await self._store(self.repository.release, [job.id for job in pending])
+        elif pending or self._delayed:
+            logger.warning(f"Dropped {len(pending) + len(self._delayed)} queued '{self.name}' jobs on shutdown.")
+
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "started": self.started,
+            "concurrency": self.concurrency,
+            "queued": self._ready.qsize() if self._ready is not None else 0,
+            "running": len(self._running),
+            "delayed": len(self._delayed),
+            "processed": dict(self.processed),
+        }
+
+
+def get_job_stats() -> dict:
+    return {name: queue.stats() for name, queue in queues.items()}
@@ -0,0 +1,93 @@
+from functools import lru_cache
+from typing import Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, raiseload, selectinload, subqueryload
+
+
+# Loading strategies of a relationship path:
+#   - "joined": LEFT OUTER JOIN in the same query, for many-to-one / one-to-one.
+#   - "selectin": one extra `WHERE pk IN (...)` query per path for all the parents, for collections.
+#   - "subquery": one extra query per path re-running the parent query as a subquery.
+#   - "raise": not loaded, accessing it raises instead of a lazy query per entry.
+#   - "auto": "selectin" for collections, "joined" otherwise.
+LOADER_STRATEGIES = ("auto", "joined", "selectin", "subquery", "raise")
+_LOADERS = {
+    "joined": joinedload,
+    "selectin": selectinload,
+    "subquery": subqueryload,
+    "raise": raiseload,
+}
+
+# Normalized loader spec: sorted (dotted path, strategy) pairs
+LoaderSpec = Tuple[Tuple[str, str], ...]
+
+
+def _path_of(field) -> str:
+    if isinstance(field, str):
+        return field
+    if isinstance(field, (list, tuple)):
+        return ".".join(_path_of(part) for part in field)
+    # Relationship attribute, e.g. `Employee.role`
+    return field.key
+
+
+def loader_spec(related_fields: Sequence = (), loaders: Optional[Mapping[str, str]] = None) -> LoaderSpec:
+    """
+    Normalize related fields and loading strategies by path into a hashable spec.
+    `related_fields` are dotted paths, relationship attributes or sequences of them
+    (a nested path), loaded with the "auto" strategy. `loaders` maps dotted paths to
+    strategies; "*" maps every other relationship, only to "raise".
+    Example call:
+        ```
+    spec = loader_spec(
+        related_fields=["role"],
+        loaders={"orders": "selectin", "orders.lines.product": "joined", "*": "raise"},
+    )
+        ```
+    """
+    spec = {_path_of(field): "auto" for field in related_fields}
+    for path, strategy in (loaders or {}).items():
+        if strategy not in LOADER_STRATEGIES:
+            raise RuntimeError(f"Improper loading strategy '{strategy}'.")
+        if path == "*" and strategy != "raise":
+            raise RuntimeError("Only the 'raise' strategy applies to every relationship ('*').")
+        spec[path] = strategy
+    return tuple(sorted(spec.items()))
+
+
+@lru_cache(maxsize=256)
+def loader_options(model, spec: LoaderSpec) -> tuple:
+    """
+    Query options of a loader spec, the relationships of every path resolved from `model`.
+    A segment of a path gets the strategy of its own path when the spec has it, "auto" otherwise.
+    """
+    strategies = dict(spec)
+    options = []
+    for path, _ in spec:
+        if path == "*":
+            options.append(raiseload("*"))
+            continue
+
+        names = path.split(".")
+        mapper = inspect(model)
+        loader = None
+        for depth, name in enumerate(names):
+            if name not in mapper.relationships:
+                raise RuntimeError(f"Non-existing relationship '{name}' in '{path}'.")
+            relationship = mapper.relationships[name]
+
+            strategy = strategies.get(".".join(names[:depth + 1]), "auto")
+            if strategy == "auto":
+                strategy = "selectin" if relationship.uselist else "joined"
+            elif strategy == "raise" and depth < len(names) - 1:
+                raise RuntimeError(f"Can not load '{path}' through a raising relationship.")
+
+            attribute = getattr(mapper.class_, name)
+            if loader is None:
+                loader = _LOADERS[strategy](attribute)
+            else:
+                loader = getattr(loader, f"{strategy}load")(attribute)
+            mapper = relationship.mapper
+        options.append(loader)
+    return tuple(options)
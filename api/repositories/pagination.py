@@ -0,0 +1,68 @@
+import base64
+import json
+import uuid
+from datetime import date, datetime
+from typing import Any, List, Tuple
+
+from sqlalchemy import Column
+
+
+NEXT = "next"
+PREV = "prev"
+
+
+def encode_cursor(values: List[Any], direction: str, sort_column_name: str, sort_order: str) -> str:
+    """
+    Encode keyset values of a row into an opaque url-safe cursor.
+    """
+    payload = {
+        "v": [_serialize_value(value) for value in values],
+        "d": direction,
+        "s": sort_column_name,
+        "o": sort_order,
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: List[Column], sort_column_name: str, sort_order: str) -> Tuple[list, str]:
+    """
+    Decode a cursor made by `encode_cursor` back into keyset values and direction.
+    The cursor has to belong to the same sorting it is used with.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = payload["v"]
+        direction = payload["d"]
+        if payload["s"] != sort_column_name or payload["o"] != sort_order:
+            raise RuntimeError("Cursor does not match the requested sorting.")
+        if direction not in (NEXT, PREV) or len(values) != len(columns):
+            raise ValueError
+        values = [_deserialize_value(column, value) for column, value in zip(columns, values)]
+    except RuntimeError:
+        raise
+    except Exception:
+        raise RuntimeError("Invalid cursor.")
+    return values, direction
+
+
+def _serialize_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _deserialize_value(column: Column, value: Any) -> Any:
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is uuid.UUID:
+        return uuid.UUID(value)
+    return python_type(value)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from db import PRIMARY, AsyncSessionLocal, routed
+
+logger = logging.getLogger(__name__)
+
+RETENTION_MODES = ("detach", "drop")
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+class MonthlyPartitions:
+    """
+    Monthly range partitions of a repository table on `created_at` (PostgreSQL):
+    `<table>_pYYYYMM` holds the entries of that month (naive UTC timestamps).
+    - Partitions are created `premake` months ahead, an insert never lacks one.
+    - Partitions older than `retention_days` are detached (kept as standalone tables,
+      to archive and drop) or dropped: no row by row DELETE, no bloat, and the index
+      size and vacuum cost stay those of the kept months.
+    Tables which are not partitioned (e.g. SQLite) get the retention as a chunked
+    `delete_where` instead.
+    NOTE: DDL takes a lock on the table, it gives up after `lock_timeout_ms` rather than
+    queue behind long queries; the next run retries.
+    """
+
+    def __init__(self,
+                 repository,
+                 premake: int = Config.PARTITION_PREMAKE_MONTHS,
+                 retention_days: int = 0,
+                 retention_mode: str = "detach",
+                 lock_timeout_ms: int = Config.PARTITION_LOCK_TIMEOUT_MS):
+        if retention_mode not in RETENTION_MODES:
+            raise RuntimeError(f"Improper retention mode '{retention_mode}'.")
+        self.repository = repository
+        self.table_name = repository.model.__tablename__
+        self.premake = premake
+        self.retention_days = retention_days
+        self.retention_mode = retention_mode
+        self.lock_timeout_ms = lock_timeout_ms
+
+
+    def partition_name(self, month: datetime) -> str:
+        return f"{self.table_name}_p{month:%Y%m}"
+
+
+    @routed(PRIMARY)
+    async def is_partitioned(self, session: AsyncSession) -> bool:
+        if session.bind.dialect.name != "postgresql":
+            return False
+        query = text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:table_name AS regclass))")
+        return bool((await session.execute(query, {"table_name": self.table_name})).scalar())
+
+
+    @routed(PRIMARY)
+    async def get_partitions(self, session: AsyncSession) -> List[Tuple[str, datetime]]:
+        """
+        Attached monthly partitions and their months, oldest first.
+        """
+        query = text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = CAST(:table_name AS regclass)"
+        )
+        prefix = f"{self.table_name}_p"
+        partitions = []
+        for name in (await session.execute(query, {"table_name": self.table_name})).scalars():
+            try:
+                partitions.append((name, datetime.strptime(name[len(prefix):], "%Y%m")))
+            except ValueError:
+                # Not one of ours, e.g. attached by hand.
+                continue
+        return sorted(partitions, key=lambda partition: partition[1])
+
+
+    async def _lock(self, session: AsyncSession) -> bool:
+        """
+        Lock the table maintenance for the transaction, False when another worker holds it.
+        """
+        await session.execute(text(f"SET LOCAL lock_timeout = {int(self.lock_timeout_ms)}"))
+        query = text("SELECT pg_try_advisory_xact_lock(hashtext(:name))")
+        return bool((await session.execute(query, {"name": f"partitions:{self.table_name}"})).scalar())
+
+
+    @routed(PRIMARY)
+    async def create_partitions(self, session: AsyncSession, now: Optional[datetime] = None) -> List[str]:
+        """
+        Create the missing partitions of the current month and `premake` months ahead.
+        Returns the names of the created partitions.
+        """
+        current = month_start(now or datetime.utcnow())
+        created = []
+        if not await self._lock(session):
+            await session.rollback()
+            return created
+        existing = {name for name, _ in await self.get_partitions(session)}
+        for offset in range(self.premake + 1):
+            month = add_months(current, offset)
+            name = self.partition_name(month)
+            if name in existing:
+                continue
+            await session.execute(text(
+                f'CREATE TABLE "{name}" PARTITION OF "{self.table_name}" '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+        await session.commit()
+        return created
+
+
+    @routed(PRIMARY)
+    async def apply_retention(self, session: AsyncSession, now: Optional[datetime] = None) -> dict:
+        """
+        Remove the entries older than `retention_days`: the partitions ending before the
+        cutoff, each in its own transaction, or a chunked delete of a table which is not partitioned.
+        """
+        if not self.retention_days:
+            return {}
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+
+        if not await self.is_partitioned(session):
+            query = self.repository.query().filter("created_at", "lt", cutoff)
+            return {"deleted": await self.repository.delete_where(session, query)}
+
+        removed = []
+        for name, month in await self.get_partitions(session):
+            if add_months(month, 1) > cutoff:
+                break
+            if not await self._lock(session):
+                break
+            # The rows leave the table without a DELETE, keep the row count deltas right.
+            await session.execute(
+                text(f'INSERT INTO row_counts (table_name, delta) SELECT :table_name, -count(*) FROM "{name}" '
+                     "HAVING count(*) > 0"),
+                {"table_name": self.table_name},
+            )
+            if self.retention_mode == "drop":
+                await session.execute(text(f'DROP TABLE "{name}"'))
+            else:
+                await session.execute(text(f'ALTER TABLE "{self.table_name}" DETACH PARTITION "{name}"'))
+            await session.commit()
+            removed.append(name)
+        await session.commit()
+        return {"dropped" if self.retention_mode == "drop" else "detached": removed}
+
+
+    @routed(PRIMARY)
+    async def maintain(self, session: AsyncSession) -> dict:
+        result = {}
+        if await self.is_partitioned(session):
+            result["created"] = await self.create_partitions(session)
+        result.update(await self.apply_retention(session))
+        return result
+
+
+async def maintain_partitions_periodically(partitions: MonthlyPartitions,
+                                           interval_sec: float = Config.PARTITION_MAINTENANCE_INTERVAL_SEC) -> None:
+    # First run at startup, so the partitions exist before the first inserts.
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                result = await partitions.maintain(session)
+            if any(result.values()):
+                logger.info(f"Maintained the '{partitions.table_name}' partitions: {result}.")
+        except SQLAlchemyError:
+            logger.exception(f"Failed to maintain the '{partitions.table_name}' partitions.")
+        await asyncio.sleep(interval_sec)
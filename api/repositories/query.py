@@ -0,0 +1,209 @@
+import operator
+from typing import Any, Mapping, Optional, Sequence, Tuple
+
+from sqlalchemy import Integer, bindparam
+from sqlalchemy.future import select
+from sqlalchemy.orm import load_only
+from sqlalchemy.sql import Select
+
+from config import Config
+from api.repositories.cache import LRUCache
+from api.repositories.loaders import LoaderSpec, loader_options, loader_spec
+
+
+# Whitelisted filter operators
+FILTER_OPERATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "in": lambda column, value: column.in_(value),
+    "not_in": lambda column, value: column.not_in(value),
+    "like": lambda column, value: column.like(value),
+    "ilike": lambda column, value: column.ilike(value),
+    # Value (True/False) is part of the query shape, not a parameter.
+    "is_null": None,
+}
+EXPANDING_OPERATORS = ("in", "not_in")
+
+# Built statements by query shape. Reusing the same statement object lets SQLAlchemy
+# skip building it and hit its compiled cache, only parameter values change per call.
+_statements = LRUCache(max_size=Config.QUERY_BUILDER_CACHE_SIZE, ttl_sec=float("inf"))
+
+
+class QueryBuilder:
+    """
+    Declarative list query of a repository model: filters, sorting, projection, related
+    entries and pagination. Values are bound as parameters, so queries of the same shape
+    share one cached statement.
+    Example call:
+        ```
+    query = (
+        QueryBuilder(Items)
+        .filter("is_active", "eq", True)
+        .filter("created_at", "ge", since)
+        .sort("created_at", "desc")
+        .sort("id", "desc")
+        .only("id", "item_id", "title")
+        .load(loaders={"tags": "selectin"})
+        .paginate(limit=50)
+    )
+    entries = await items_repository.get_list(session, query)
+        ```
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._columns = model.__table__.columns
+        self._filters = []
+        self._sorts = []
+        self._fields = ()
+        self._loaders: LoaderSpec = ()
+        self._limit = None
+        self._offset = None
+
+
+    def _check_column(self, column_name: str) -> None:
+        # `in` of a column collection raises on anything but a string
+        if not isinstance(column_name, str) or column_name not in self._columns:
+            raise RuntimeError(f"Non-existing column name '{column_name}'.")
+
+
+    def filter(self, column_name: str, op: str = "eq", value: Any = None) -> "QueryBuilder":
+        self._check_column(column_name)
+        if op not in FILTER_OPERATORS:
+            raise RuntimeError(f"Improper filter operator '{op}'.")
+        if op == "is_null":
+            value = bool(value)
+        elif op in EXPANDING_OPERATORS:
+            value = list(value)
+        self._filters.append((column_name, op, value))
+        return self
+
+
+    def sort(self, column_name: str, order: str = "asc") -> "QueryBuilder":
+        self._check_column(column_name)
+        if order not in ("asc", "desc"):
+            raise RuntimeError(f"Improper sorting order '{order}'.")
+        self._sorts.append((column_name, order))
+        return self
+
+
+    def only(self, *column_names: str) -> "QueryBuilder":
+        """
+        Load only the given columns (the pk is always loaded). Accessing other
+        columns of the entries raises instead of issuing a query per entry.
+        """
+        for column_name in column_names:
+            self._check_column(column_name)
+        self._fields = tuple(column_names)
+        return self
+
+
+    def load(self, related_fields: Sequence = (), loaders: Optional[Mapping[str, str]] = None) -> "QueryBuilder":
+        """
+        Load related entries of all the listed entries at once, see `loader_spec`.
+        With "selectin" collections (the "auto" default) the number of queries depends on
+        the number of paths, not on the number of entries.
+        """
+        self._loaders = loader_spec(related_fields, loaders)
+        loader_options(self.model, self._loaders)  # validates the paths
+        return self
+
+
+    @property
+    def loads_related(self) -> bool:
+        return bool(self._loaders)
+
+
+    def paginate(self, limit: Optional[int], offset: Optional[int] = None) -> "QueryBuilder":
+        self._limit = limit
+        self._offset = offset or None
+        return self
+
+
+    @property
+    def shape(self) -> tuple:
+        """
+        Everything about the query except its parameter values.
+        """
+        return (
+            self.model,
+            tuple((column_name, op, value if op == "is_null" else None) for column_name, op, value in self._filters),
+            tuple(self._sorts),
+            self._fields,
+            self._loaders,
+            self._limit is not None,
+            self._offset is not None,
+        )
+
+
+    @property
+    def params(self) -> dict:
+        params = {
+            f"filter_{index}": value
+            for index, (_, op, value) in enumerate(self._filters)
+            if op != "is_null"
+        }
+        if self._limit is not None:
+            params["limit"] = self._limit
+        if self._offset is not None:
+            params["offset"] = self._offset
+        return params
+
+
+    def statement(self) -> Tuple[Select, dict]:
+        """
+        Return the (cached) statement of the query shape and its parameters.
+        """
+        shape = self.shape
+        query = _statements.get(shape)
+        if query is None:
+            query = self._build()
+            _statements.set(shape, query)
+        return query, self.params
+
+
+    def criteria(self) -> list:
+        """
+        WHERE clauses of the filters, their values bound by `params`.
+        """
+        clauses = []
+        for index, (column_name, op, value) in enumerate(self._filters):
+            column = getattr(self.model, column_name)
+            if op == "is_null":
+                clauses.append(column.is_(None) if value else column.is_not(None))
+                continue
+            param = bindparam(
+                f"filter_{index}",
+                type_=self._columns[column_name].type,
+                expanding=op in EXPANDING_OPERATORS,
+            )
+            clauses.append(FILTER_OPERATORS[op](column, param))
+        return clauses
+
+
+    def _build(self) -> Select:
+        query = select(self.model)
+
+        if self._fields:
+            query = query.options(
+                load_only(*[getattr(self.model, column_name) for column_name in self._fields], raiseload=True)
+            )
+
+        if self._loaders:
+            query = query.options(*loader_options(self.model, self._loaders))
+
+        query = query.where(*self.criteria())
+
+        for column_name, order in self._sorts:
+            column = getattr(self.model, column_name)
+            query = query.order_by(column.desc() if order == "desc" else column.asc())
+
+        if self._limit is not None:
+            query = query.limit(bindparam("limit", type_=Integer))
+        if self._offset is not None:
+            query = query.offset(bindparam("offset", type_=Integer))
+        return query
@@ -1 +1 @@
-from api.schemas.items import ItemsSchema
\ No newline at end of file
+from api.schemas.items import ItemsSchema, ItemsPageSchema, PageLinksSchema
\ No newline at end of file
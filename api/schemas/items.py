@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List
 from pydantic import BaseModel
 
 
@@ -14,8 +14,24 @@ class ItemsSchema(BaseModel):
     is_active: Optional[bool] = None
     items_number : Optional[int] = None
     ip_address: Optional[str] = None
+    price: Optional[float] = None
 
     
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+
+class PageLinksSchema(BaseModel):
+    next: Optional[str] = None
+    prev: Optional[str] = None
+
+
+class ItemsPageSchema(BaseModel):
+    items: List[ItemsSchema]
+    page_size: int
+    # Approximate unless `Config.PAGINATION_COUNT_STRATEGY` is "exact"
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    links: PageLinksSchema
@@ -1,47 +1,34 @@
-import uuid
-from json import JSONDecodeError
-from fastapi import HTTPException
-from fastapi.encoders import jsonable_encoder
-from starlette.requests import Request
-
-
-def generate_ping_id(string_length: int = 10) -> str:
-    """Returns a random string of length string_length."""
-    random = str(uuid.uuid4()).upper().replace("-", "")  # Convert UUID format to a Python string.
-    return random[0:string_length]  # Return the random string.
-
-
-async def check_content_type_and_get_data(request: Request) -> dict:
-    content_type = request.headers.get('Content-Type')
-    if content_type is None:
-        url_params = request.query_params
-        if url_params:
-            data = url_params._dict
-            return {
-                'method': 'GET',
-                'content_type': '',
-                'data': data
-            }
-        raise HTTPException(status_code=400, detail='No Content-Type provided!')
-    
-    elif content_type == 'application/json':
-        try:
-            data = await request.json()
-        except JSONDecodeError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-        
-    elif (content_type == 'application/x-www-form-urlencoded' or
-          content_type.startswith('multipart/form-data')):
-        try:
-            data = await request.form()
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
-        
-    else:
-        raise HTTPException(status_code=400, detail='Content-Type not supported!')
-    
-    return {
-        'method': 'POST',
-        'content_type': content_type,
-        'data': jsonable_encoder(data)
-    }
\ No newline at end of file
+import csv
+import hashlib
+import io
+import orjson
+
+from api.ids import item_id_generator
+
+
+def generate_ping_id() -> str:
+    """Returns a new time-ordered item id, a ULID by default (see `Config.ITEM_ID_GENERATOR`)."""
+    return item_id_generator.new_str()
+
+
+def rows_to_ndjson(column_names: list, rows) -> bytes:
+    """Serialize row tuples into NDJSON lines."""
+    return b''.join(
+        orjson.dumps(dict(zip(column_names, row)), default=str, option=orjson.OPT_APPEND_NEWLINE)
+        for row in rows
+    )
+
+
+def rows_to_csv(rows, header: list = None) -> bytes:
+    """Serialize row tuples (and an optional header) into CSV lines."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def payload_hash(data) -> str:
+    """SHA-256 of a parsed request payload, the same whatever the body format and key order."""
+    return hashlib.sha256(orjson.dumps(data, option=orjson.OPT_SORT_KEYS)).hexdigest()
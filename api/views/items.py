@@ -1,10 +1,16 @@
 from config import Config
-from db import get_session
+from db import get_session, AsyncSessionLocal
 from starlette.requests import Request
-from fastapi import APIRouter, Depends
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from api.repositories import items_repository
-from api.utils import check_content_type_and_get_data
+from api.repositories import idempotency_repository, items_repository
+from api.repositories.base import unit_of_work
+from api.schemas import ItemsSchema, ItemsPageSchema, PageLinksSchema
+from api.parsers import parse_item, parse_batch
+from api.utils import payload_hash, rows_to_ndjson, rows_to_csv
+from exceptions import IdempotencyKeyInProgress, IdempotencyKeyInvalid, IdempotencyKeyMismatch
 
 
 router = APIRouter(
@@ -12,11 +18,126 @@ router = APIRouter(
     tags=["Items"],
 )
 
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENT_REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+
+async def run_idempotent(request: Request, session: AsyncSession, data, process) -> ORJSONResponse:
+    """
+    Run `process(session, data, ip_address=...)` once per client and `Idempotency-Key`
+    header, retries get the response of the first request replayed.
+    """
+    key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+    if key is None or not Config.IDEMPOTENCY_ENABLED:
+        # Committed here, before responding, in a single commit.
+        async with unit_of_work(session):
+            response = await process(session, data, ip_address=request.client.host)
+        # Plain dict of JSON types, rendered directly without `jsonable_encoder`.
+        return ORJSONResponse(response)
+
+    async def handler():
+        return 200, await process(session, data, ip_address=request.client.host)
+
+    # Keys are scoped by client, the same one as admission control.
+    api_key = request.headers.get(Config.ADMISSION_CLIENT_HEADER) if Config.ADMISSION_CLIENT_HEADER else None
+    client = f"key:{api_key}" if api_key else f"ip:{request.client.host}"
+    try:
+        result = await idempotency_repository.run(
+            session, client=client, key=key, request_hash=payload_hash(data), handler=handler,
+        )
+    except (IdempotencyKeyInvalid, IdempotencyKeyMismatch, IdempotencyKeyInProgress) as e:
+        # Only the key's own errors, the ones of `handler` propagate.
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    headers = {IDEMPOTENT_REPLAYED_HEADER: "true"} if result.replayed else None
+    return ORJSONResponse(result.response, status_code=result.status_code, headers=headers)
+
 
 
 @router.post("/create",) 
 async def incoming_ping(request: Request, session: AsyncSession = Depends(get_session)):
-    validated_data = await check_content_type_and_get_data(request)
-    validated_data['data']['ip_address'] = request.client.host
-    response = await items_repository.process_data(session, validated_data)
-    return response
\ No newline at end of file
+    payload = await parse_item(request)
+    return await run_idempotent(request, session, payload.data, items_repository.process_data)
+
+
+@router.post("/batch",)
+async def incoming_batch(request: Request, session: AsyncSession = Depends(get_session)):
+    payload = await parse_batch(request)
+    return await run_idempotent(request, session, payload.data, items_repository.process_batch)
+
+
+
+@router.get("/list", response_model=ItemsPageSchema)
+async def list_items(
+    request: Request,
+    cursor: Optional[str] = None,
+    page_size: int = Query(50, ge=1, le=Config.ITEMS_PAGE_SIZE_MAX),
+    sort: str = "created_at",
+    order: str = Query("desc", regex="^(asc|desc)$"),
+    session: AsyncSession = Depends(get_session),
+):
+    try:
+        page = await items_repository.get_list_keyset(
+            session, page_size=page_size, sort_column_name=sort, sort_order=order, cursor=cursor,
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total = await items_repository.get_count(session, strategy=Config.PAGINATION_COUNT_STRATEGY)
+
+    def page_link(page_cursor):
+        if page_cursor is None:
+            return None
+        return str(request.url.include_query_params(cursor=page_cursor))
+
+    return ItemsPageSchema(
+        items=page['entries'],
+        page_size=page_size,
+        total=total,
+        next_cursor=page['next_cursor'],
+        prev_cursor=page['prev_cursor'],
+        links=PageLinksSchema(next=page_link(page['next_cursor']), prev=page_link(page['prev_cursor'])),
+    )
+
+
+
+@router.get("/export")
+async def export_items(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    fields: Optional[str] = Query(None, description="Comma separated column names, all columns by default."),
+):
+    column_names = [name.strip() for name in fields.split(',') if name.strip()] if fields else [
+        column.name for column in items_repository.model.__table__.columns
+    ]
+    unknown_columns = set(column_names) - set(items_repository.model.__table__.columns.keys())
+    if unknown_columns:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown_columns))}")
+
+    async def content():
+        # Own session: it has to live as long as the response is being streamed.
+        # Each chunk is awaited by the server before the next fetch, so slow clients
+        # slow down the cursor instead of piling rows up in memory.
+        async with AsyncSessionLocal() as session:
+            if format == "csv":
+                yield rows_to_csv([], header=column_names)
+            async for rows in items_repository.stream_rows(session, column_names=column_names):
+                if format == "csv":
+                    yield rows_to_csv(rows)
+                else:
+                    yield rows_to_ndjson(column_names, rows)
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        content(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=items.{format}"},
+    )
+
+
+
+# NOTE: keep it last, so it does not shadow the static paths above.
+@router.get("/{item_id}", response_model=ItemsSchema)
+async def get_item(item_id: str, session: AsyncSession = Depends(get_session)):
+    entry = await items_repository.get_by_column_value(session, column_name="item_id", value=item_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Item not found.")
+    return entry
@@ -0,0 +1,49 @@
+from config import Config
+from db import get_pool_stats, get_replica_stats
+from fastapi import APIRouter
+from api.middleware.admission import get_admission_stats
+from api.repositories.cache import get_cache_stats
+from api.repositories.jobs import get_job_stats
+from logs import get_log_stats
+
+
+router = APIRouter(
+    prefix=f"{Config.API_ROUTER_PREFIX}/system",
+    tags=["System"],
+)
+
+
+
+@router.get("/pool")
+async def pool_stats():
+    return get_pool_stats()
+
+
+
+@router.get("/replicas")
+async def replica_stats():
+    return get_replica_stats()
+
+
+
+@router.get("/cache")
+async def cache_stats():
+    return get_cache_stats()
+
+
+
+@router.get("/logging")
+async def log_stats():
+    return get_log_stats()
+
+
+
+@router.get("/admission")
+async def admission_stats():
+    return get_admission_stats()
+
+
+
+@router.get("/jobs")
+async def job_stats():
+    return get_job_stats()
@@ -1,12 +1,13 @@
-import logging
+import asyncio
 
 import uvicorn
 from fastapi import FastAPI
-from fastapi_sqlalchemy import DBSessionMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from config import Config
 import db
+from logs import configure_logging
 
 
 def init_app(settings=Config) -> FastAPI:
@@ -14,13 +15,31 @@ def init_app(settings=Config) -> FastAPI:
     Initialize and configure FastAPI app.
     """
 
+    configure_logging(settings)
+
     app = FastAPI(
         title="FastAPI Starting Structure",
         description="",
         version="1.0.0",
+        default_response_class=ORJSONResponse,
     )
 
-    app.add_middleware(DBSessionMiddleware, db_url=settings.DATABASE_URL)
+    if settings.ADMISSION_ENABLED:
+        from api.middleware.admission import AdmissionControlMiddleware
+        # Added first, so it is the innermost middleware: rejections still get CORS
+        # headers, a request id, an access log entry and metrics.
+        app.add_middleware(
+            AdmissionControlMiddleware,
+            name="ingest",
+            paths=settings.ADMISSION_PATHS,
+            client_header=settings.ADMISSION_CLIENT_HEADER,
+            rate_per_sec=settings.ADMISSION_RATE_PER_SEC,
+            burst=settings.ADMISSION_BURST,
+            max_clients=settings.ADMISSION_MAX_CLIENTS,
+            max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT,
+            max_queue=settings.ADMISSION_MAX_QUEUE,
+            queue_timeout_ms=settings.ADMISSION_QUEUE_TIMEOUT_MS,
+        )
 
     app.add_middleware(
         CORSMiddleware,
@@ -30,18 +49,71 @@ def init_app(settings=Config) -> FastAPI:
         allow_headers=Config.CORS_ALLOW_HEADERS,
     )
 
+    from api.middleware.request_context import RequestContextMiddleware
+    app.add_middleware(RequestContextMiddleware)
+
+    if settings.SLOW_QUERY_LOG_ENABLED:
+        for engine in (db.async_engine, *db.replica_engines):
+            db.log_slow_queries(engine, settings.SLOW_QUERY_MS)
+
+    if settings.METRICS_ENABLED:
+        from api.metrics import instrument_engine
+        from api.middleware.metrics import MetricsMiddleware
+        for engine in (db.async_engine, *db.replica_engines):
+            instrument_engine(engine)
+        # Added last, so it is the outermost middleware and times everything.
+        app.add_middleware(MetricsMiddleware)
+
     # Startup events
     @app.on_event("startup")
     async def startup():
-        logger = logging.getLogger("uvicorn.access")
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-        logger.addHandler(handler)
+        if settings.METRICS_ENABLED and settings.METRICS_MULTIPROC_DIR:
+            from api.metrics import write_snapshots_periodically
+            app.state.metrics_task = asyncio.create_task(write_snapshots_periodically())
+        if settings.IDEMPOTENCY_ENABLED and settings.IDEMPOTENCY_PURGE_INTERVAL_SEC > 0:
+            from api.repositories import idempotency_repository
+            from api.repositories.idempotency import purge_expired_keys_periodically
+            app.state.idempotency_purge_task = asyncio.create_task(
+                purge_expired_keys_periodically(idempotency_repository, settings.IDEMPOTENCY_PURGE_INTERVAL_SEC)
+            )
+        if settings.PARTITION_MAINTENANCE_INTERVAL_SEC > 0:
+            from api.repositories import items_repository
+            from api.repositories.partitions import maintain_partitions_periodically
+            app.state.partitions_task = asyncio.create_task(
+                maintain_partitions_periodically(items_repository.partitions, settings.PARTITION_MAINTENANCE_INTERVAL_SEC)
+            )
+        if settings.COUNT_COUNTER_COMPACT_INTERVAL_SEC > 0:
+            from api.repositories import items_repository
+            from api.repositories.base import compact_row_counts_periodically
+            app.state.row_counts_task = asyncio.create_task(
+                compact_row_counts_periodically(items_repository, settings.COUNT_COUNTER_COMPACT_INTERVAL_SEC)
+            )
+        if settings.JOBS_ENABLED:
+            from api.repositories import job_queue
+            job_queue.start()
+
+    # Shutdown events
+    @app.on_event("shutdown")
+    async def shutdown():
+        for task_name in ("metrics_task", "idempotency_purge_task", "partitions_task", "row_counts_task"):
+            task = getattr(app.state, task_name, None)
+            if task is not None:
+                task.cancel()
+
+        from api.repositories import items_repository
+        if items_repository.write_buffer is not None:
+            await items_repository.write_buffer.close()
+
+        # After the buffer: jobs of the buffered items can still find them.
+        from api.repositories import job_queue
+        await job_queue.close()
 
     # Include routers / configure routers
 
     from api.views.items import router as items_router
+    from api.views.system import router as system_router
     app.include_router(items_router)
+    app.include_router(system_router)
 
 
     # testing by passing welcome message
@@ -49,20 +121,30 @@ def init_app(settings=Config) -> FastAPI:
     async def welcome():
         return {"message": "Welcome to FastAPI starting."}
 
+    if settings.METRICS_ENABLED:
+        from api.metrics import render_metrics
+
+        @app.get('/metrics', include_in_schema=False)
+        async def metrics():
+            return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
     return app
 
 
 app = init_app(settings=Config)
 
-log_config = uvicorn.config.LOGGING_CONFIG
-log_config["formatters"]["access"]["fmt"] = "%(asctime)s - %(levelname)s - %(message)s"
-
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app:app",
-        port=int(Config.APP_PORT),
-        host=Config.APP_HOST,
-        log_config=log_config,
-        reload=True
-    )
+    if Config.SERVER_MODE == "prod":
+        from server import run
+        run()
+    else:
+        uvicorn.run(
+            "app:app",
+            port=int(Config.APP_PORT),
+            host=Config.APP_HOST,
+            # Logging is set up by `init_app`, access logs by `RequestContextMiddleware`.
+            log_config=None,
+            access_log=False,
+            reload=True
+        )
@@ -0,0 +1,129 @@
+"""
+Event loop stalls caused by logging under load.
+
+Concurrent tasks log like request handlers do while a monitor task measures how
+late the event loop wakes it up. Compares the previous setup (`basicConfig`, a
+`StreamHandler` writing from the event loop) with the queue handler of `logs.py`.
+The log sink is slowed down by `--sink-delay-ms` per write, like a full pipe or a
+slow terminal/log collector would.
+
+Run from the project root:
+    python -m benchmarks.loop_stall --tasks 100 --records 200 --sink-delay-ms 0.2
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from config import Config
+import logs
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class SlowStream:
+    """
+    Stream discarding what is written, after `delay_sec` per write.
+    """
+
+    def __init__(self, delay_sec: float):
+        self.delay_sec = delay_sec
+        self.file = open(os.devnull, "w")
+
+    def write(self, text: str) -> int:
+        if self.delay_sec:
+            time.sleep(self.delay_sec)
+        return self.file.write(text)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+def configure_blocking(stream) -> None:
+    """The logging setup as it was before: records written from the event loop."""
+    logs.stop_listener()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(levelname)s:%(filename)s:%(lineno)04d:%(funcName)s:%(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(logging.DEBUG)
+
+
+def configure_queued(stream, log_format: str) -> None:
+    class Settings(Config):
+        LOG_LEVEL = "DEBUG"
+        LOG_FORMAT = log_format
+
+    logs.configure_logging(Settings, stream=stream)
+
+
+async def run(args) -> dict:
+    logger = logging.getLogger("benchmarks.loop_stall")
+    lags = []
+    done = asyncio.Event()
+
+    async def monitor():
+        interval = args.interval_ms / 1000
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started - interval)
+
+    async def handler(number: int):
+        for record in range(args.records):
+            token = logs.request_id_var.set(f"{number}-{record}")
+            logger.info("Handled request %s of task %s", record, number, extra={"status": 200})
+            logs.request_id_var.reset(token)
+            await asyncio.sleep(0)
+
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    await asyncio.gather(*[handler(number) for number in range(args.tasks)])
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor_task
+
+    lags.sort()
+    return {
+        "records_per_sec": round(args.tasks * args.records / elapsed, 1),
+        "lag_p50_ms": round(percentile(lags, 0.50) * 1000, 3),
+        "lag_p99_ms": round(percentile(lags, 0.99) * 1000, 3),
+        "lag_max_ms": round(lags[-1] * 1000, 3) if lags else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100, help="concurrent logging tasks")
+    parser.add_argument("--records", type=int, default=200, help="records logged per task")
+    parser.add_argument("--sink-delay-ms", type=float, default=0.2, help="time the sink blocks per write")
+    parser.add_argument("--interval-ms", type=float, default=1.0, help="monitor wake up interval")
+    parser.add_argument("--format", choices=("json", "text"), default="json", help="format of the queued setup")
+    args = parser.parse_args()
+
+    stream = SlowStream(args.sink_delay_ms / 1000)
+    for name, configure in (
+        ("blocking", lambda: configure_blocking(stream)),
+        ("queued", lambda: configure_queued(stream, args.format)),
+    ):
+        configure()
+        result = asyncio.run(run(args))
+        dropped = logs.get_log_stats()["dropped"] if name == "queued" else 0
+        drain_started = time.perf_counter()
+        logs.stop_listener()
+        drain_ms = (time.perf_counter() - drain_started) * 1000
+        print(
+            f"{name:>8}: {result['records_per_sec']:>10.1f} records/s  loop lag p50 {result['lag_p50_ms']:>8.3f} ms  "
+            f"p99 {result['lag_p99_ms']:>8.3f} ms  max {result['lag_max_ms']:>8.3f} ms  "
+            f"dropped {dropped}  drained in {drain_ms:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
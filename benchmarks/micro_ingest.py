@@ -0,0 +1,80 @@
+"""
+Per-request CPU cost of the ingest hot path, without network and database.
+
+Compares the original path (schema built four times, `jsonable_encoder` over the
+payload, default JSON response) with the current one (validated once, orjson).
+
+Run from the project root:
+    python -m benchmarks.micro_ingest
+"""
+import argparse
+import json
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+import orjson
+
+from api.repositories.items import ItemsRepository
+from api.schemas import ItemsSchema
+from api.utils import generate_ping_id
+
+
+BODY = json.dumps({
+    "title": "Item title",
+    "description": "Item description " * 20,
+    "items_number": 42,
+}).encode()
+
+
+def legacy_ingest(body: bytes) -> bytes:
+    """The ingest path as it was before: parse, encode, validate x4, default JSON response."""
+    data = jsonable_encoder(json.loads(body))
+    data['ip_address'] = "127.0.0.1"
+    item_id = generate_ping_id()
+    payload = ItemsSchema(
+        item_id=item_id,
+        ip_address=data['ip_address'],
+        is_active=False,
+        title=data['title'],
+        description=data['description'],
+        items_number=data['items_number'],
+    ).dict()
+    payload.update({'item_accepted': True})
+    ItemsSchema(**payload)
+    response = {"result": "Success", "item_id": item_id, "price": 0.00, "message": "Item accept"}
+    payload.update({'response': response})
+    row = ItemsSchema(**payload).dict()  # noqa: F841, passed to `create`
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def current_ingest(body: bytes, repository: ItemsRepository) -> bytes:
+    data = orjson.loads(body)
+    item, _ = repository.validate_item(generate_ping_id(), data, ip_address="127.0.0.1")
+    row = repository.item_row(item)  # noqa: F841, passed to `create`
+    return ORJSONResponse(repository.accepted_response(item, {"price": 0.00})).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="calls per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    repository = ItemsRepository()
+    cases = {
+        "legacy": lambda: legacy_ingest(BODY),
+        "current": lambda: current_ingest(BODY, repository),
+    }
+
+    results = {}
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=args.number, repeat=args.repeat))
+        results[name] = best / args.number * 1e6
+        print(f"{name:>8}: {results[name]:8.2f} us/request")
+
+    print(f" speedup: {results['legacy'] / results['current']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
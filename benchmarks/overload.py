@@ -0,0 +1,153 @@
+"""
+Tail latency of the ingest endpoint under overload, without and with admission control.
+
+A noisy client sends `/api/items/create` requests at `--noisy-rps`, whatever the
+responses (open loop, like a burst from a seller's batch job), well above what the
+database absorbs, while `--quiet-clients` clients with their own API keys send one
+request every `--quiet-interval-ms`. The app runs in a local uvicorn process with a
+small connection pool, so the database is the bottleneck.
+
+Without admission control every request queues for a connection: latency grows
+for the whole run, for everybody. With it the noisy client is rate limited (429)
+and the excess is shed (503) right away, so admitted requests keep a bounded latency.
+
+Run from the project root (use a throwaway database, items are written):
+    DATABASE_URL=sqlite+aiosqlite:///bench.db python -m benchmarks.overload --duration 10
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.load import create_schema, free_port, item_body, percentile
+
+
+class Group:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.rejected_latencies = []
+        self.statuses = {}
+
+    def record(self, status_code: int, latency: float) -> None:
+        self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+        (self.latencies if status_code < 400 else self.rejected_latencies).append(latency)
+
+    def report(self, elapsed: float) -> str:
+        self.latencies.sort()
+        self.rejected_latencies.sort()
+        statuses = "  ".join(f"{status}: {count}" for status, count in sorted(self.statuses.items()))
+        return (
+            f"  {self.name:>6}: {len(self.latencies) / elapsed:>8.1f} ok/s  "
+            f"ok p50 {percentile(self.latencies, 0.50) * 1000:>8.2f} ms  "
+            f"p99 {percentile(self.latencies, 0.99) * 1000:>8.2f} ms  "
+            f"max {(self.latencies[-1] if self.latencies else 0) * 1000:>8.2f} ms  "
+            f"rejected p99 {percentile(self.rejected_latencies, 0.99) * 1000:>7.2f} ms  [{statuses}]"
+        )
+
+
+async def send(client: httpx.AsyncClient, group: Group, api_key: str, number: int) -> None:
+    started = time.perf_counter()
+    try:
+        response = await client.post("/api/items/create", json=item_body(number), headers={"X-API-Key": api_key})
+        status_code = response.status_code
+    except httpx.HTTPError:
+        # Timed out or refused, counted as 599
+        status_code = 599
+    group.record(status_code, time.perf_counter() - started)
+
+
+async def noisy_client(client: httpx.AsyncClient, group: Group, rps: float, deadline: float) -> None:
+    tasks = []
+    interval = 1 / rps
+    next_at = time.perf_counter()
+    number = 0
+    while next_at < deadline:
+        tasks.append(asyncio.create_task(send(client, group, "noisy", number)))
+        number += 1
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    await asyncio.gather(*tasks)
+
+
+async def quiet_client(client: httpx.AsyncClient, group: Group, api_key: str, interval: float,
+                       deadline: float) -> None:
+    number = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await send(client, group, api_key, number)
+        number += 1
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+async def run_mode(admission: bool, args) -> None:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, "ADMISSION_ENABLED": str(admission)},
+    )
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout,
+                                     limits=limits) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start.")
+
+            noisy, quiet = Group("noisy"), Group("quiet")
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(
+                noisy_client(client, noisy, args.noisy_rps, deadline),
+                *[quiet_client(client, quiet, f"quiet-{number}", args.quiet_interval_ms / 1000, deadline)
+                  for number in range(args.quiet_clients)],
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    print(f"admission control {'on' if admission else 'off'}:")
+    print(noisy.report(elapsed))
+    print(quiet.report(elapsed))
+
+
+async def run(args) -> None:
+    await create_schema()
+    for admission in (False, True):
+        await run_mode(admission, args)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per mode")
+    parser.add_argument("--noisy-rps", type=float, default=300.0,
+                        help="offered load of the noisy client, above the ok/s of the run without admission control")
+    parser.add_argument("--quiet-clients", type=int, default=5)
+    parser.add_argument("--quiet-interval-ms", type=float, default=100.0)
+    parser.add_argument("--pool-size", type=int, default=4, help="database connections of the server")
+    parser.add_argument("--max-connections", type=int, default=500, help="HTTP connections of the clients")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    # Read by `config.py`, here and in the server process.
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("DB_POOL_SIZE", str(args.pool_size))
+    os.environ.setdefault("DB_POOL_MAX_OVERFLOW", "0")
+    os.environ.setdefault("DB_POOL_TIMEOUT_SEC", str(args.timeout))
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
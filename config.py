@@ -1,5 +1,4 @@
 import ast
-import logging
 import os
 
 from dotenv import load_dotenv
@@ -7,10 +6,6 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# NOTE: see additional setup of logging for `uvicorn`.
-logging.basicConfig(level=logging.DEBUG,
-                    format="%(levelname)s:%(filename)s:%(lineno)04d:%(funcName)s:%(message)s")
-
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
@@ -26,6 +21,31 @@ class Config:
     APP_HOST = os.getenv("APP_HOST", "0.0.0.0")
     APP_PORT = int(os.getenv("PORT", "8000"))
 
+    # Server: "dev" runs a single auto-reloading uvicorn process, "prod" a gunicorn
+    # process manager with uvicorn workers (see `server.py`).
+    SERVER_MODE = os.getenv("SERVER_MODE", "dev" if DEBUG else "prod")
+    # 0 means one worker per available CPU core.
+    SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+    SERVER_PRELOAD = ast.literal_eval(os.getenv("SERVER_PRELOAD", "True"))
+    # Time given to workers to finish in-flight requests on restart/shutdown.
+    SERVER_GRACEFUL_TIMEOUT_SEC = int(os.getenv("SERVER_GRACEFUL_TIMEOUT_SEC", "30"))
+    SERVER_TIMEOUT_SEC = int(os.getenv("SERVER_TIMEOUT_SEC", "60"))
+    SERVER_KEEPALIVE_SEC = int(os.getenv("SERVER_KEEPALIVE_SEC", "5"))
+    SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+    # Recycle a worker after that many requests (plus jitter), 0 disables it.
+    SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "0"))
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "0"))
+
+    # Logging, see `logs.py`. Defaults depend on ENV: verbose text locally, JSON elsewhere.
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if ENV in ("dev", "local") else "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text" if ENV in ("dev", "local") else "json")
+    # Records waiting for the writer thread, further records are dropped.
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Share of successful requests written to the access log, 0 disables them.
+    LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", "1.0"))
+    # Slower requests and server errors are always logged.
+    LOG_SLOW_REQUEST_MS = float(os.getenv("LOG_SLOW_REQUEST_MS", "1000"))
+
     API_ROUTER_PREFIX = "/api"
 
     # Database
@@ -36,10 +56,148 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 
     DB_DIALECT_DRIVER = "postgresql+asyncpg"
-    DATABASE_URL = f"{DB_DIALECT_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DATABASE}"
+    # A full URL overrides the parts above, e.g. a throwaway database for benchmarks.
+    DATABASE_URL = os.getenv(
+        "DATABASE_URL",
+        f"{DB_DIALECT_DRIVER}://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DATABASE}",
+    )
+
+    # Read replicas, comma separated URLs of the same dialect/driver as DATABASE_URL.
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    # "round_robin" or "least_busy" (fewest checked out connections).
+    DB_REPLICA_POLICY = os.getenv("DB_REPLICA_POLICY", "round_robin")
+    # An unhealthy replica gets no reads for that long.
+    DB_REPLICA_RETRY_SEC = float(os.getenv("DB_REPLICA_RETRY_SEC", "30"))
+
+    # Id generators, see `api/ids.py`: "uuid7", "ulid" (time-ordered) or "uuid4" (random).
+    ID_GENERATOR = os.getenv("ID_GENERATOR", "uuid7")
+    ITEM_ID_GENERATOR = os.getenv("ITEM_ID_GENERATOR", "ulid")
+
+    # Development aid: log statements slower than SLOW_QUERY_MS with their plan, see `db.log_slow_queries`.
+    SLOW_QUERY_LOG_ENABLED = ast.literal_eval(os.getenv("SLOW_QUERY_LOG_ENABLED", str(ENV in ("dev", "local"))))
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
 
     ECHO_SQL = ast.literal_eval(os.getenv("ECHO_SQL", "True"))
-    POOL_RECYCLE_SEC = 3600 * 5  # 5 min
+
+    # Connection pool
+    # NOTE: pool is per worker process, total connections = workers * (size + overflow).
+    DB_POOL_ENABLED = ast.literal_eval(os.getenv("DB_POOL_ENABLED", "True"))
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+    DB_POOL_PRE_PING = ast.literal_eval(os.getenv("DB_POOL_PRE_PING", "True"))
+    DB_POOL_TIMEOUT_SEC = float(os.getenv("DB_POOL_TIMEOUT_SEC", "10"))
+    POOL_RECYCLE_SEC = int(os.getenv("POOL_RECYCLE_SEC", str(60 * 5)))  # 5 min
+
+    # SQLAlchemy compiled statement cache (per engine) and query builder statement cache
+    DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+    QUERY_BUILDER_CACHE_SIZE = int(os.getenv("QUERY_BUILDER_CACHE_SIZE", "500"))
+
+    # asyncpg statement caches (per connection)
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+    DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
+    # Read-through entity cache
+    CACHE_ENABLED = ast.literal_eval(os.getenv("CACHE_ENABLED", "False"))
+    CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))  # entries per repository
+    CACHE_TTL_SEC = float(os.getenv("CACHE_TTL_SEC", "30"))
+
+    # Admission control of the DB-bound endpoints, see `api/middleware/admission.py`.
+    # NOTE: limits are per worker process.
+    ADMISSION_ENABLED = ast.literal_eval(os.getenv("ADMISSION_ENABLED", "True"))
+    ADMISSION_PATHS = [path.strip() for path in os.getenv(
+        "ADMISSION_PATHS", f"{API_ROUTER_PREFIX}/items/create,{API_ROUTER_PREFIX}/items/batch",
+    ).split(",") if path.strip()]
+    # Per-client token buckets, keyed on this header (e.g. an API key) or the client IP.
+    # 0 disables the per-client limit.
+    ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "X-API-Key")
+    ADMISSION_RATE_PER_SEC = float(os.getenv("ADMISSION_RATE_PER_SEC", "50"))
+    ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "100"))
+    ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))  # buckets kept
+    # Global cap of admitted requests, defaults to the connections of the pool.
+    ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW)))
+    # Requests waiting for a slot, further ones and the ones waiting longer are rejected.
+    ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+    ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "1000"))
+
+    # Idempotency-Key support of the ingest endpoints, see `api/repositories/idempotency.py`.
+    IDEMPOTENCY_ENABLED = ast.literal_eval(os.getenv("IDEMPOTENCY_ENABLED", "True"))
+    # Keys are kept that long, then purged every IDEMPOTENCY_PURGE_INTERVAL_SEC (0 disables it).
+    IDEMPOTENCY_TTL_SEC = int(os.getenv("IDEMPOTENCY_TTL_SEC", str(60 * 60 * 24)))  # 1 day
+    IDEMPOTENCY_PURGE_INTERVAL_SEC = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SEC", str(60 * 60)))
+    IDEMPOTENCY_CACHE_MAX_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_MAX_SIZE", "10000"))  # responses per worker
+
+    # Background jobs, see `api/repositories/jobs.py`. Disabled: follow-up work (e.g. item
+    # enrichment) runs inline in the request.
+    JOBS_ENABLED = ast.literal_eval(os.getenv("JOBS_ENABLED", "True"))
+    # "memory" (per worker process, lost on restart) or "database" (the durable `jobs` table,
+    # claimed with SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL).
+    JOBS_BACKEND = os.getenv("JOBS_BACKEND", "memory")
+    JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "4"))  # jobs run at once per worker process
+    JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "20"))  # jobs claimed per query
+    JOBS_POLL_INTERVAL_MS = float(os.getenv("JOBS_POLL_INTERVAL_MS", "1000"))
+    # A claimed job is claimed again after that, e.g. when its worker died.
+    JOBS_LEASE_SEC = float(os.getenv("JOBS_LEASE_SEC", str(60 * 5)))
+    # Failed runs are retried with exponential backoff (and jitter), up to JOBS_MAX_ATTEMPTS runs.
+    JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+    JOBS_BACKOFF_BASE_MS = float(os.getenv("JOBS_BACKOFF_BASE_MS", "500"))
+    JOBS_BACKOFF_MAX_MS = float(os.getenv("JOBS_BACKOFF_MAX_MS", str(60 * 1000)))
+    # Jobs waiting in memory, further ones are dropped (memory backend).
+    JOBS_MAX_QUEUE = int(os.getenv("JOBS_MAX_QUEUE", "10000"))
+    # Running jobs get that long to finish on shutdown.
+    JOBS_SHUTDOWN_TIMEOUT_SEC = float(os.getenv("JOBS_SHUTDOWN_TIMEOUT_SEC", "10"))
+
+    # Request bodies
+    MAX_BODY_SIZE = int(os.getenv("MAX_BODY_SIZE", str(1024 * 1024)))  # 1 MB
+    MAX_BATCH_BODY_SIZE = int(os.getenv("MAX_BATCH_BODY_SIZE", str(32 * 1024 * 1024)))  # 32 MB
+
+    # Pagination
+    ITEMS_PAGE_SIZE_MAX = int(os.getenv("ITEMS_PAGE_SIZE_MAX", "500"))
+    # Count strategy of pagination totals, see `BaseRepository.get_count`
+    PAGINATION_COUNT_STRATEGY = os.getenv("PAGINATION_COUNT_STRATEGY", "estimate")
+
+    # Counts
+    COUNT_CACHE_TTL_SEC = float(os.getenv("COUNT_CACHE_TTL_SEC", "10"))
+    COUNT_CACHE_MAX_SIZE = int(os.getenv("COUNT_CACHE_MAX_SIZE", "1000"))
+    # `row_counts` deltas are folded into one row past the threshold, checked every interval (0 disables it).
+    COUNT_COUNTER_COMPACT_THRESHOLD = int(os.getenv("COUNT_COUNTER_COMPACT_THRESHOLD", "1000"))  # delta rows
+    COUNT_COUNTER_COMPACT_INTERVAL_SEC = float(os.getenv("COUNT_COUNTER_COMPACT_INTERVAL_SEC", "60"))
+
+    # Streaming export
+    STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", "1000"))  # rows per server-side cursor fetch
+
+    # Bulk writes
+    BULK_COPY_THRESHOLD = int(os.getenv("BULK_COPY_THRESHOLD", "1000"))  # rows
+    ITEMS_BATCH_MAX_SIZE = int(os.getenv("ITEMS_BATCH_MAX_SIZE", "10000"))
+    # Chunked `delete_where` / `update_where`: rows per transaction and the pause between them.
+    CHUNKED_WRITE_BATCH_SIZE = int(os.getenv("CHUNKED_WRITE_BATCH_SIZE", "1000"))
+    CHUNKED_WRITE_PAUSE_MS = float(os.getenv("CHUNKED_WRITE_PAUSE_MS", "50"))
+
+    # Monthly partitions of items by created_at (PostgreSQL), see `api/repositories/partitions.py`.
+    # Partitions are created PARTITION_PREMAKE_MONTHS ahead by a periodic job (0 disables the job).
+    PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+    PARTITION_MAINTENANCE_INTERVAL_SEC = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SEC", str(60 * 60)))
+    # DDL gives up instead of queueing behind long queries (and blocking everything after it).
+    PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("PARTITION_LOCK_TIMEOUT_MS", "5000"))
+    # Items older than that are removed by whole partitions, 0 keeps them forever.
+    ITEMS_RETENTION_DAYS = int(os.getenv("ITEMS_RETENTION_DAYS", "0"))
+    # "detach" keeps the old partitions as standalone tables to archive, "drop" deletes them.
+    ITEMS_RETENTION_MODE = os.getenv("ITEMS_RETENTION_MODE", "detach")
+
+    # Write-behind ingestion buffer
+    INGEST_BUFFER_ENABLED = ast.literal_eval(os.getenv("INGEST_BUFFER_ENABLED", "False"))
+    INGEST_BUFFER_MAX_ROWS = int(os.getenv("INGEST_BUFFER_MAX_ROWS", "500"))
+    INGEST_BUFFER_MAX_DELAY_MS = int(os.getenv("INGEST_BUFFER_MAX_DELAY_MS", "50"))
+    # False -> respond before the row is written (fire-and-forget, rows may be lost on crash)
+    INGEST_BUFFER_WAIT_FOR_FLUSH = ast.literal_eval(os.getenv("INGEST_BUFFER_WAIT_FOR_FLUSH", "True"))
+    # "insert" (batched executemany INSERT) or "copy" (asyncpg COPY)
+    INGEST_BUFFER_FLUSH_METHOD = os.getenv("INGEST_BUFFER_FLUSH_METHOD", "insert")
+    INGEST_BUFFER_MAX_CONCURRENT_FLUSHES = int(os.getenv("INGEST_BUFFER_MAX_CONCURRENT_FLUSHES", "2"))
+
+    # Metrics
+    METRICS_ENABLED = ast.literal_eval(os.getenv("METRICS_ENABLED", "True"))
+    # Shared directory of worker snapshots, set it when running several workers.
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+    METRICS_FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "5"))
 
     # CORS middleware configs
     CORS_ALLOW_CREDENTIALS = True
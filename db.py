@@ -1,9 +1,17 @@
+import functools
+import inspect
+import itertools
 import logging
-from typing import AsyncIterator
+import time
+import weakref
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, List, Optional
 
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
 from config import Config
 from exceptions import CustomSqlAlchemyException
@@ -11,27 +19,438 @@ from exceptions import CustomSqlAlchemyException
 logger = logging.getLogger(__name__)
 
 
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records how long callers wait for a connection checkout.
+    """
+
+    # Callables getting every checkout wait in seconds, e.g. a metrics histogram.
+    wait_observers = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total_sec = 0.0
+        self.checkout_wait_max_sec = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.checkout_timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.checkout_wait_total_sec += waited
+            if waited > self.checkout_wait_max_sec:
+                self.checkout_wait_max_sec = waited
+            for observer in self.wait_observers:
+                observer(waited)
+
+
+def get_engine_options(settings=Config) -> dict:
+    """
+    Build `create_async_engine` keyword arguments from the config.
+    """
+    options = {
+        "query_cache_size": settings.DB_QUERY_CACHE_SIZE,
+    }
+    if settings.DATABASE_URL.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {
+            # asyncpg's own statement cache
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            # SQLAlchemy asyncpg adapter prepared statement cache
+            "prepared_statement_cache_size": settings.DB_PREPARED_STATEMENT_CACHE_SIZE,
+        }
+
+    if not settings.DB_POOL_ENABLED:
+        options["poolclass"] = NullPool
+        return options
+
+    options.update({
+        "poolclass": InstrumentedAsyncPool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_POOL_MAX_OVERFLOW,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "pool_timeout": settings.DB_POOL_TIMEOUT_SEC,
+        "pool_recycle": settings.POOL_RECYCLE_SEC,
+    })
+    return options
+
+
 async_engine = create_async_engine(
     Config.DATABASE_URL,
-    poolclass=NullPool,
+    **get_engine_options(Config),
     # echo=Config.ECHO_SQL,
 )
 
+replica_engines = [
+    create_async_engine(url, **get_engine_options(Config))
+    for url in Config.DATABASE_REPLICA_URLS
+]
+
+
+# Routing of sessions between the primary and the replicas
+
+PRIMARY = "primary"
+REPLICA = "replica"
+REPLICA_POLICIES = ("round_robin", "least_busy")
+
+# `AsyncSession.info` keys of the routing
+ROUTE_KEY = "db_route"
+FORCED_ROUTE_KEY = "db_route_forced"
+# Set once the session wrote, its later reads go to the primary (read-your-writes).
+WROTE_KEY = "db_wrote"
+# Replica engine of the current transaction, the engine of the last statement and the
+# engines the current transaction is connected to.
+REPLICA_BIND_KEY = "db_replica_bind"
+LAST_BIND_KEY = "db_last_bind"
+CONNECTED_KEY = "db_connected"
+
+
+class ReplicaSet:
+    """
+    Read replicas with their selection policy and health. A replica failing to
+    connect is skipped for `retry_sec`, then tried again.
+    """
+
+    def __init__(self, engines: list, policy: str = Config.DB_REPLICA_POLICY, retry_sec: float = Config.DB_REPLICA_RETRY_SEC):
+        if policy not in REPLICA_POLICIES:
+            raise RuntimeError(f"Improper replica policy '{policy}'.")
+        self.engines = [engine.sync_engine for engine in engines]
+        self.policy = policy
+        self.retry_sec = retry_sec
+        self._unhealthy_until = {}
+        self._routed = {engine: 0 for engine in self.engines}
+        self._round_robin = itertools.count()
+
+        for engine in self.engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def _on_error(self, exception_context) -> None:
+        if exception_context.is_disconnect and exception_context.engine is not None:
+            self.mark_unhealthy(exception_context.engine, exception_context.original_exception)
+
+    def mark_unhealthy(self, engine, exc: BaseException) -> None:
+        if self.is_healthy(engine):
+            logger.warning(f"Replica {engine.url.render_as_string()} is unhealthy, reads go to the primary: {exc!r}")
+        self._unhealthy_until[engine] = time.monotonic() + self.retry_sec
+
+    def is_healthy(self, engine) -> bool:
+        return self._unhealthy_until.get(engine, 0) <= time.monotonic()
+
+    def choose(self):
+        """
+        Sync engine of a healthy replica, None when there is none.
+        """
+        healthy = [engine for engine in self.engines if self.is_healthy(engine)]
+        if not healthy:
+            return None
+        if self.policy == "least_busy":
+            engine = min(healthy, key=lambda engine: getattr(engine.pool, "checkedout", lambda: 0)())
+        else:
+            engine = healthy[next(self._round_robin) % len(healthy)]
+        self._routed[engine] += 1
+        return engine
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                "url": engine.url.render_as_string(),
+                "healthy": self.is_healthy(engine),
+                "routed": self._routed[engine],
+                "checked_out": getattr(engine.pool, "checkedout", lambda: None)(),
+            }
+            for engine in self.engines
+        ]
+
+
+replicas = ReplicaSet(replica_engines)
+
+
+class RoutingSession(Session):
+    """
+    Session sending reads routed to `REPLICA` (see `routed` / `route`) to a replica,
+    everything else to the primary. Once the session wrote, all its statements go to
+    the primary, so it reads its own writes. Explicit `session.connection()` calls
+    count as writes, they are used for raw driver access like COPY.
+    The replica is chosen once per transaction and kept until it is unhealthy: replicas
+    lag by different amounts, the reads of a transaction see a single one of them.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        engine = self._route(mapper, clause)
+        self.info[LAST_BIND_KEY] = engine
+        return engine
+
+    def _route(self, mapper, clause):
+        primary = async_engine.sync_engine
+        if self.info.get(WROTE_KEY):
+            return primary
+        if self._flushing or (clause is None and mapper is None) or (clause is not None and clause.is_dml):
+            self.info[WROTE_KEY] = True
+            return primary
+
+        target = self.info.get(FORCED_ROUTE_KEY) or self.info.get(ROUTE_KEY) or PRIMARY
+        if target == REPLICA:
+            engine = self.info.get(REPLICA_BIND_KEY)
+            if engine is None or not replicas.is_healthy(engine):
+                engine = replicas.choose()
+                self.info[REPLICA_BIND_KEY] = engine
+            if engine is not None:
+                return engine
+        return primary
+
+
+@event.listens_for(RoutingSession, "after_begin")
+def _track_connection(session, transaction, connection):
+    session.info.setdefault(CONNECTED_KEY, set()).add(connection.engine)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _untrack_connections(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(CONNECTED_KEY, None)
+        session.info.pop(REPLICA_BIND_KEY, None)
+
+
+@contextmanager
+def route(session: AsyncSession, target: str) -> Iterator[AsyncSession]:
+    """
+    Force the route of every query of the session in the block, over the
+    route chosen by the repository methods.
+    Example call:
+        ```
+    with route(session, PRIMARY):
+        entry = await items_repository.get(session, pk)  # not lagging behind
+        ```
+    """
+    previous = session.info.get(FORCED_ROUTE_KEY)
+    session.info[FORCED_ROUTE_KEY] = target
+    try:
+        yield session
+    finally:
+        _restore(session.info, FORCED_ROUTE_KEY, previous)
+
+
+def routed(target: str):
+    """
+    Route the queries of a repository method (its first argument after `self` being
+    the session) to `target` unless the caller forces a route with `route`.
+    A replica read failing to connect is marked unhealthy and retried on the primary.
+    """
+    def decorator(method):
+        if inspect.isasyncgenfunction(method):
+            @functools.wraps(method)
+            async def generator_wrapper(self, session: AsyncSession, *args, **kwargs):
+                previous = session.info.get(ROUTE_KEY)
+                session.info[ROUTE_KEY] = target
+                try:
+                    async for item in method(self, session, *args, **kwargs):
+                        yield item
+                finally:
+                    _restore(session.info, ROUTE_KEY, previous)
+            return generator_wrapper
+
+        @functools.wraps(method)
+        async def wrapper(self, session: AsyncSession, *args, **kwargs):
+            previous = session.info.get(ROUTE_KEY)
+            session.info[ROUTE_KEY] = target
+            session.info.pop(LAST_BIND_KEY, None)
+            try:
+                return await method(self, session, *args, **kwargs)
+            except (DBAPIError, OSError) as exc:
+                engine = session.info.get(LAST_BIND_KEY)
+                if engine not in replicas.engines or not _is_connection_error(exc):
+                    raise
+                replicas.mark_unhealthy(engine, exc)
+                session.info.pop(REPLICA_BIND_KEY, None)
+                if engine in session.info.get(CONNECTED_KEY, ()):
+                    # Failed within a transaction, it has to be rolled back by the caller.
+                    raise
+                # Failed to connect, nothing happened in the session yet.
+                session.info[ROUTE_KEY] = PRIMARY
+                return await method(self, session, *args, **kwargs)
+            finally:
+                _restore(session.info, ROUTE_KEY, previous)
+        return wrapper
+    return decorator
+
+
+def _restore(info: dict, key: str, previous: Optional[str]) -> None:
+    if previous is None:
+        info.pop(key, None)
+    else:
+        info[key] = previous
+
+
+def _is_connection_error(exc: BaseException) -> bool:
+    if isinstance(exc, OSError):
+        return True
+    return isinstance(exc, DBAPIError) and (exc.connection_invalidated or isinstance(exc, (OperationalError, InterfaceError)))
+
+
 AsyncSessionLocal = async_sessionmaker(
     bind=async_engine,
     class_=AsyncSession,
     expire_on_commit=False,
+    # Plain sessions without replicas, routing has nothing to choose from.
+    sync_session_class=RoutingSession if replica_engines else Session,
 )
 
 
+def get_replica_stats() -> dict:
+    return {
+        "policy": replicas.policy,
+        "replicas": replicas.stats(),
+    }
+
+
+# Slow query capture
+
+slow_query_logger = logging.getLogger("db.slow_query")
+_slow_query_engines = weakref.WeakSet()
+
+
+def log_slow_queries(engine, threshold_ms: float = Config.SLOW_QUERY_MS) -> None:
+    """
+    Log the statements of the engine slower than `threshold_ms`, with their plan on PostgreSQL:
+    `EXPLAIN (ANALYZE, BUFFERS)` for SELECTs, plain `EXPLAIN` for anything else as ANALYZE
+    would run it again. Meant for development, ANALYZE doubles the cost of slow SELECTs.
+    """
+    sync_engine = engine.sync_engine
+    if sync_engine in _slow_query_engines:
+        return
+    _slow_query_engines.add(sync_engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - conn.info["slow_query_started"].pop()) * 1000
+        if duration_ms < threshold_ms:
+            return
+        plan = None
+        if not executemany and conn.dialect.name == "postgresql":
+            plan = _explain(conn, statement, parameters)
+        slow_query_logger.warning(
+            "Slow query (%.1f ms): %s%s", duration_ms, statement, f"\n{plan}" if plan else "",
+            extra={"duration_ms": round(duration_ms, 3)},
+        )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("slow_query_started"):
+            connection.info["slow_query_started"].pop()
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    # Only a plain SELECT is safe to run again, `WITH` may wrap writes.
+    analyze = statement.lstrip()[:6].upper() == "SELECT"
+    explain = f"EXPLAIN (ANALYZE, BUFFERS) {statement}" if analyze else f"EXPLAIN {statement}"
+    # A new DBAPI cursor, the one of the statement may still hold its rows. The savepoint
+    # keeps a failing EXPLAIN from aborting the transaction of the caller.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(explain, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception as exc:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            plan = f"EXPLAIN failed: {exc!r}"
+    finally:
+        cursor.close()
+    return plan
+
+
+def get_pool_stats(engine=async_engine) -> dict:
+    """
+    Current pool occupancy and cumulative checkout statistics of the engine.
+    """
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedAsyncPool):
+        return {"pool": pool.__class__.__name__, "enabled": False}
+
+    return {
+        "pool": pool.__class__.__name__,
+        "enabled": True,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+        "timeout_sec": pool.timeout(),
+        "checkouts": pool.checkouts,
+        "checkout_timeouts": pool.checkout_timeouts,
+        "checkout_wait_total_sec": round(pool.checkout_wait_total_sec, 6),
+        "checkout_wait_avg_sec": round(pool.checkout_wait_total_sec / pool.checkouts, 6) if pool.checkouts else 0.0,
+        "checkout_wait_max_sec": round(pool.checkout_wait_max_sec, 6),
+    }
+
+
+class QueryCounter:
+    """
+    Count database round trips (statements and transaction commits/rollbacks) made
+    through the engine, e.g. to assert how many queries a repository method issues.
+    Example call:
+        ```
+    with QueryCounter() as counter:
+        await items_repository.update(session, pk, title="title")
+    assert counter.count == 2, counter.statements  # UPDATE ... RETURNING, COMMIT
+        ```
+    NOTE: counts everything going through the engine, not only the current task.
+    """
+
+    def __init__(self, engine=async_engine):
+        self.engine = engine.sync_engine
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def _on_commit(self, conn):
+        self.statements.append("COMMIT")
+
+    def _on_rollback(self, conn):
+        self.statements.append("ROLLBACK")
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        event.listen(self.engine, "commit", self._on_commit)
+        event.listen(self.engine, "rollback", self._on_rollback)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+        event.remove(self.engine, "commit", self._on_commit)
+        event.remove(self.engine, "rollback", self._on_rollback)
+
+
 async def get_session() -> AsyncIterator[async_sessionmaker]:
     """
     Dependency function that yields db async sessions.
+    NOTE: the session checks out a connection on its first query and returns it once
+    the transaction ends, routes which do not query never touch the pool.
     """
     async with AsyncSessionLocal() as session:
         try:
             yield session
-            await session.commit()
+            if session.in_transaction():
+                await session.commit()
         except SQLAlchemyError as exc:
             # Transaction failed
             msg = f"SQLAlchemyError happened in the session dependency: {repr(exc)}"
@@ -48,3 +48,27 @@ class CustomSqlAlchemyException(CustomApiException):
         self.message = self.default_detail
         if message:
             self.message = f"{self.message} {message}"
+
+
+class IdempotencyKeyInvalid(CustomApiException):
+    """
+    An `Idempotency-Key` header of an improper length.
+    """
+    status_code = http_status.HTTP_400_BAD_REQUEST
+    default_detail = "Improper Idempotency-Key."
+
+
+class IdempotencyKeyMismatch(CustomApiException):
+    """
+    An `Idempotency-Key` reused with a different request payload.
+    """
+    status_code = http_status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "Idempotency-Key was already used with a different request."
+
+
+class IdempotencyKeyInProgress(CustomApiException):
+    """
+    The request of an `Idempotency-Key` is still being processed.
+    """
+    status_code = http_status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is being processed, retry later."
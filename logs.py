@@ -0,0 +1,148 @@
+"""
+Logging of the app: records are put on a queue by the caller and written by a
+background thread, so the event loop never blocks on the log stream.
+
+Records carry the id of the request being handled (see `request_id_var`) and are
+written as JSON lines, or as plain text with `LOG_FORMAT=text`.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import orjson
+
+from config import Config
+
+
+# Id of the request handled by the current task, set by `RequestContextMiddleware`.
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes every `LogRecord` has, anything else was passed through `extra`.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, with the fields passed through `extra` at the top level.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class LogQueueHandler(QueueHandler):
+    """
+    Queue handler which never blocks nor raises: records are dropped (and counted)
+    when the writer thread cannot keep up.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The request id is only known in the task that logged. The traceback refers
+        # to live frames, so it is rendered here; formatting is left to the writer thread.
+        record = copy.copy(record)
+        record.request_id = request_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[LogQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(settings=Config, stream=None) -> None:
+    """
+    Route all loggers through the queue handler, replacing handlers set up before.
+    """
+    global _handler, _listener
+    stop_listener()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if settings.LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    _handler = LogQueueHandler(queue.Queue(settings.LOG_QUEUE_SIZE))
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(settings.LOG_LEVEL)
+
+    # Uvicorn logs through the root logger; its own access log is replaced by `RequestContextMiddleware`.
+    for name in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+    access_logger = logging.getLogger("uvicorn.access")
+    access_logger.handlers = []
+    access_logger.propagate = False
+
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_listener() -> None:
+    """
+    Write out the queued records and stop the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork() -> None:
+    # Only the forking thread survives a fork: the writer thread is gone, and the
+    # queue may have been locked by it. Start over with a new queue and thread.
+    global _listener
+    if _listener is None:
+        return
+    _handler.queue = queue.Queue(Config.LOG_QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def get_log_stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+    }
+
+
+atexit.register(stop_listener)
+os.register_at_fork(after_in_child=_restart_after_fork)
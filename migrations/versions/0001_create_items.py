@@ -0,0 +1,86 @@
+"""Create items with their indexes and the row_counts deltas
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+ROW_COUNTS_FUNCTION = """
+CREATE OR REPLACE FUNCTION row_counts_track() RETURNS trigger AS $body$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO row_counts (table_name, delta)
+        SELECT TG_TABLE_NAME, count(*) FROM new_rows HAVING count(*) > 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO row_counts (table_name, delta)
+        SELECT TG_TABLE_NAME, -count(*) FROM old_rows HAVING count(*) > 0;
+    END IF;
+    RETURN NULL;
+END
+$body$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        'row_counts',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('table_name', sa.String(length=63), nullable=False),
+        sa.Column('delta', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_row_counts_table_name', 'row_counts', ['table_name'])
+
+    op.create_table(
+        'items',
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('item_id', sa.String(), nullable=False),
+        sa.Column('title', sa.String(length=255), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('items_number', sa.Integer(), nullable=True),
+        sa.Column('ip_address', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_items_item_id', 'items', ['item_id'], unique=True)
+    op.create_index('ix_items_created_at_id', 'items', ['created_at', 'id'])
+    op.create_index(
+        'ix_items_active_created_at_id', 'items', ['created_at', 'id'],
+        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active'),
+    )
+    op.create_index('ix_items_ip_address', 'items', ['ip_address'])
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(ROW_COUNTS_FUNCTION)
+        op.execute("""
+            CREATE TRIGGER items_row_count_insert AFTER INSERT ON items
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION row_counts_track()
+        """)
+        op.execute("""
+            CREATE TRIGGER items_row_count_delete AFTER DELETE ON items
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION row_counts_track()
+        """)
+
+
+def downgrade() -> None:
+    # The triggers go with the table.
+    op.drop_table('items')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP FUNCTION IF EXISTS row_counts_track()')
+    op.drop_index('ix_row_counts_table_name', table_name='row_counts')
+    op.drop_table('row_counts')
@@ -0,0 +1,139 @@
+"""Partition items by month of created_at
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:30:00.000000
+
+The existing rows are copied into monthly partitions, from the month of the oldest
+one to 3 months ahead; later months are created by `MonthlyPartitions`. The copy
+rewrites the table, run it in a maintenance window on a big one.
+On SQLite only the item_id index changes, as in the model.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = 'id, created_at, updated_at, item_id, title, description, is_active, items_number, ip_address'
+# Rows without created_at belong to no partition.
+SELECT_COLUMNS = COLUMNS.replace('created_at', "coalesce(created_at, now() AT TIME ZONE 'UTC')", 1)
+
+MONTHLY_PARTITIONS = """
+DO $body$
+DECLARE
+    month timestamp;
+BEGIN
+    FOR month IN SELECT generate_series(
+        date_trunc('month', coalesce((SELECT min(created_at) FROM items_unpartitioned), now() AT TIME ZONE 'UTC')),
+        date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+        interval '1 month'
+    ) LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF items FOR VALUES FROM (%L) TO (%L)',
+            'items_p' || to_char(month, 'YYYYMM'), month, month + interval '1 month'
+        );
+    END LOOP;
+END
+$body$
+"""
+
+
+def create_indexes() -> None:
+    op.create_index('ix_items_created_at_id', 'items', ['created_at', 'id'])
+    op.create_index(
+        'ix_items_active_created_at_id', 'items', ['created_at', 'id'],
+        postgresql_where=sa.text('is_active'),
+    )
+    op.create_index('ix_items_ip_address', 'items', ['ip_address'])
+
+
+def create_row_count_triggers() -> None:
+    op.execute("""
+        CREATE TRIGGER items_row_count_insert AFTER INSERT ON items
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION row_counts_track()
+    """)
+    op.execute("""
+        CREATE TRIGGER items_row_count_delete AFTER DELETE ON items
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION row_counts_track()
+    """)
+
+
+def items_columns() -> list:
+    return [
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('item_id', sa.String(), nullable=False),
+        sa.Column('title', sa.String(length=255), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('items_number', sa.Integer(), nullable=True),
+        sa.Column('ip_address', sa.String(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        # Not partitioned, `created_at` is part of the declared primary key all the same.
+        op.execute("UPDATE items SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        with op.batch_alter_table('items') as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+        op.drop_index('ix_items_item_id', table_name='items')
+        op.create_index('ix_items_item_id', 'items', ['item_id'])
+        return
+
+    # The old table keeps its triggers and indexes until dropped, names have to be free.
+    op.rename_table('items', 'items_unpartitioned')
+    op.execute('ALTER TABLE items_unpartitioned RENAME CONSTRAINT items_pkey TO items_unpartitioned_pkey')
+    for index_name in ('ix_items_item_id', 'ix_items_created_at_id', 'ix_items_active_created_at_id', 'ix_items_ip_address'):
+        op.drop_index(index_name, table_name='items_unpartitioned')
+
+    op.create_table(
+        'items',
+        *items_columns(),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        postgresql_partition_by='RANGE (created_at)',
+    )
+    # Partitioned indexes, created on every partition.
+    op.create_index('ix_items_item_id', 'items', ['item_id'])
+    create_indexes()
+    op.execute(MONTHLY_PARTITIONS)
+
+    # Before the triggers: the rows are counted already.
+    op.execute(f'INSERT INTO items ({COLUMNS}) SELECT {SELECT_COLUMNS} FROM items_unpartitioned')
+    op.drop_table('items_unpartitioned')
+    create_row_count_triggers()
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('items') as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
+        op.drop_index('ix_items_item_id', table_name='items')
+        op.create_index('ix_items_item_id', 'items', ['item_id'], unique=True)
+        return
+
+    op.rename_table('items', 'items_partitioned')
+    op.execute('ALTER TABLE items_partitioned RENAME CONSTRAINT items_pkey TO items_partitioned_pkey')
+    for index_name in ('ix_items_item_id', 'ix_items_created_at_id', 'ix_items_active_created_at_id', 'ix_items_ip_address'):
+        op.drop_index(index_name, table_name='items_partitioned')
+
+    op.create_table(
+        'items',
+        *items_columns(),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute(f'INSERT INTO items ({COLUMNS}) SELECT {COLUMNS} FROM items_partitioned')
+    # The partitions go with the table.
+    op.drop_table('items_partitioned')
+    op.create_index('ix_items_item_id', 'items', ['item_id'], unique=True)
+    create_indexes()
+    create_row_count_triggers()
@@ -0,0 +1,86 @@
+"""
+Production server: a gunicorn process manager running uvicorn workers on uvloop
+and httptools, configured from `Config`.
+
+This module is also the gunicorn config (`-c python:server`), so the same settings
+apply when starting gunicorn directly:
+    python -m gunicorn -c python:server
+or through the app:
+    SERVER_MODE=prod python app.py
+
+SIGTERM stops the workers gracefully: they stop accepting connections, finish
+in-flight requests (up to `SERVER_GRACEFUL_TIMEOUT_SEC`) and run the shutdown
+events, flushing buffered writes. SIGHUP replaces the workers the same way.
+"""
+import os
+import sys
+
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+from config import Config
+
+
+def available_cpus() -> int:
+    try:
+        # CPUs this process may run on, e.g. limited by a container cpuset.
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """
+    Uvicorn worker with uvloop and httptools required, instead of silently
+    falling back to asyncio and h11 when they are not installed.
+    """
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
+
+
+# Gunicorn settings
+
+wsgi_app = "app:app"
+bind = f"{Config.APP_HOST or '0.0.0.0'}:{Config.APP_PORT}"
+backlog = Config.SERVER_BACKLOG
+# Async workers: one event loop per core.
+workers = Config.SERVER_WORKERS or available_cpus()
+worker_class = "server.UvicornWorker"
+# Import the app, routes and models once in the master, workers fork with them loaded.
+preload_app = Config.SERVER_PRELOAD
+timeout = Config.SERVER_TIMEOUT_SEC
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT_SEC
+keepalive = Config.SERVER_KEEPALIVE_SEC
+max_requests = Config.SERVER_MAX_REQUESTS
+max_requests_jitter = Config.SERVER_MAX_REQUESTS_JITTER
+
+
+# Gunicorn server hooks
+
+def on_starting(server):
+    # Snapshots of the workers of a previous run would be summed with the current ones.
+    if Config.METRICS_MULTIPROC_DIR and os.path.isdir(Config.METRICS_MULTIPROC_DIR):
+        for name in os.listdir(Config.METRICS_MULTIPROC_DIR):
+            if name.startswith("metrics_"):
+                os.remove(os.path.join(Config.METRICS_MULTIPROC_DIR, name))
+
+
+def post_fork(server, worker):
+    """
+    Give every worker its own connection pool. The engine may have been created in the
+    master (preload), and connections inherited through fork share their sockets with
+    the master and the other workers. `close=False` drops them without closing, which
+    would otherwise end the connections for their other holders as well.
+    """
+    import db
+    for engine in (db.async_engine, *db.replica_engines):
+        engine.sync_engine.dispose(close=False)
+
+
+def run() -> None:
+    from gunicorn.app.wsgiapp import run as gunicorn_run
+
+    sys.argv = [sys.argv[0], "-c", "python:server"]
+    gunicorn_run()
+
+
+if __name__ == "__main__":
+    run()
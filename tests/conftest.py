@@ -0,0 +1,56 @@
+"""
+Tests run against a throwaway SQLite database (or TEST_DATABASE_URL), set before
+the app modules read `Config`.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+else:
+    _DATABASE_DIR = tempfile.mkdtemp(prefix="fastapi-tests-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_DATABASE_DIR, 'test.db')}"
+    # SQLite has a single writer, concurrent requests queue for the one connection
+    # instead of failing with "database is locked".
+    os.environ["DB_POOL_SIZE"] = "1"
+    os.environ["DB_POOL_MAX_OVERFLOW"] = "0"
+# A single client sending thousands of requests, not what admission control is for.
+os.environ["ADMISSION_ENABLED"] = "False"
+# Enrichment inline, no background tasks outliving a test.
+os.environ["JOBS_ENABLED"] = "False"
+os.environ["SLOW_QUERY_LOG_ENABLED"] = "False"
+os.environ["LOG_LEVEL"] = "WARNING"
+os.environ["LOG_ACCESS_SAMPLE_RATE"] = "0"
+# Every request of the stress test waits for a connection, none should give up.
+os.environ["DB_POOL_TIMEOUT_SEC"] = "120"
+
+import db  # noqa: E402
+from api.models.base import metadata  # noqa: E402
+import api.models  # noqa: E402, F401, registers the models on the metadata
+import tests.models  # noqa: E402, F401, models with relationships
+
+
+def run_async(coroutine):
+    """
+    Run a test coroutine on a new event loop. Pooled connections belong to the loop,
+    they are closed along with it.
+    """
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await db.async_engine.dispose()
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    async def create_schema():
+        async with db.async_engine.begin() as connection:
+            await connection.run_sync(metadata.drop_all)
+            await connection.run_sync(metadata.create_all)
+    run_async(create_schema())
+    yield
@@ -0,0 +1,45 @@
+"""
+Models with relationships for the repository tests, the app models have none.
+"""
+from sqlalchemy import Column, ForeignKey, String, Uuid
+from sqlalchemy.orm import relationship
+
+from api.models import BaseModel
+from api.repositories.base import BaseRepository
+
+
+class Parent(BaseModel):
+    __tablename__ = "test_parents"
+
+    name = Column(String(255))
+    children = relationship("Child", back_populates="parent", foreign_keys="Child.parent_id")
+
+
+class Child(BaseModel):
+    """
+    Children nest (`children` of a child), for relationship paths of any depth.
+    """
+
+    __tablename__ = "test_children"
+
+    name = Column(String(255))
+    parent_id = Column(Uuid, ForeignKey("test_parents.id"), nullable=True)
+    child_of_id = Column(Uuid, ForeignKey("test_children.id"), nullable=True)
+    parent = relationship("Parent", back_populates="children", foreign_keys=[parent_id])
+    children = relationship("Child", foreign_keys=[child_of_id])
+
+
+class ParentsRepository(BaseRepository):
+    def __init__(self):
+        super().__init__()
+        self.model = Parent
+
+
+class ChildrenRepository(BaseRepository):
+    def __init__(self):
+        super().__init__()
+        self.model = Child
+
+
+parents_repository = ParentsRepository()
+children_repository = ChildrenRepository()
@@ -0,0 +1,35 @@
+"""
+The "counter" count strategy, PostgreSQL only (the deltas are written by triggers).
+"""
+import pytest
+
+from config import Config
+from db import AsyncSessionLocal, QueryCounter, async_engine
+from api.repositories import items_repository
+from api.utils import generate_ping_id
+from tests.conftest import run_async
+
+pytestmark = pytest.mark.skipif(
+    async_engine.dialect.name != "postgresql", reason="row_counts deltas are written by PostgreSQL triggers",
+)
+
+
+def test_counter_is_read_only_and_compacted_apart(monkeypatch):
+    monkeypatch.setattr(Config, "COUNT_COUNTER_COMPACT_THRESHOLD", 1)
+
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            for _ in range(3):
+                await items_repository.create(session, item_id=generate_ping_id(), title="title")
+            exact = await items_repository.get_count(session, strategy="exact")
+
+            with QueryCounter() as counter:
+                count = await items_repository.get_count(session, strategy="counter")
+            assert count == exact
+            assert [statement.split(None, 1)[0].upper() for statement in counter.statements] == ["SELECT"]
+
+            assert await items_repository.compact_row_counts(session) >= 3
+            assert await items_repository.compact_row_counts(session) == 0
+            assert await items_repository.get_count(session, strategy="counter") == exact
+
+    run_async(scenario())
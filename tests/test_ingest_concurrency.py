@@ -0,0 +1,61 @@
+"""
+Thousands of overlapping ingest requests against one app instance (one worker, one
+event loop): every response has to belong to its own request, nothing may leak
+between requests sharing `items_repository`.
+"""
+import asyncio
+
+import httpx
+from sqlalchemy import select, text
+
+from app import init_app
+from db import AsyncSessionLocal, async_engine
+from api.models import Items
+from tests.conftest import run_async
+
+REQUESTS = 2000
+
+
+def payload_of(number: int) -> dict:
+    return {
+        "title": f"title {number}",
+        "description": f"description of item {number}",
+        "items_number": number,
+    }
+
+
+def test_concurrent_creates_get_their_own_responses():
+    async def scenario():
+        # The first connection of a pool runs its "first_connect" handlers under a thread
+        # lock, opened by the whole burst at once it deadlocks the event loop thread.
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+        async with httpx.AsyncClient(app=init_app(), base_url="http://test", timeout=120) as client:
+            responses = await asyncio.gather(*(
+                client.post("/api/items/create", json=payload_of(number))
+                for number in range(REQUESTS)
+            ))
+
+        item_ids = {}
+        for number, response in enumerate(responses):
+            assert response.status_code == 200, response.text
+            body = response.json()
+            assert body["result"] == "Success", body
+            item_ids[body["item_id"]] = number
+        # A response per request, each with its own item.
+        assert len(item_ids) == REQUESTS
+
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                select(Items.item_id, Items.title, Items.description, Items.items_number)
+                .where(Items.item_id.in_(list(item_ids)))
+            )).all()
+        assert len(rows) == REQUESTS
+        for row in rows:
+            expected = payload_of(item_ids[row.item_id])
+            assert (row.title, row.description, row.items_number) == (
+                expected["title"], expected["description"], expected["items_number"],
+            )
+
+    run_async(scenario())
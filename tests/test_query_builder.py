@@ -0,0 +1,34 @@
+"""
+`QueryBuilder` input checks, raised as `RuntimeError` for the views to answer with a 400.
+"""
+import pytest
+
+from api.models import Items
+from api.repositories import items_repository
+from api.repositories.query import QueryBuilder
+from db import AsyncSessionLocal
+from tests.conftest import run_async
+
+
+@pytest.mark.parametrize("column_name", [None, 1, "missing"])
+def test_improper_column_names(column_name):
+    with pytest.raises(RuntimeError, match="Non-existing column name"):
+        QueryBuilder(Items).sort(column_name)
+    with pytest.raises(RuntimeError, match="Non-existing column name"):
+        QueryBuilder(Items).filter(column_name, "eq", 1)
+
+
+def test_improper_sorting_order():
+    with pytest.raises(RuntimeError, match="Improper sorting order"):
+        QueryBuilder(Items).sort("created_at", "up")
+
+
+def test_sorted_paginated_without_sort_column():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            entries = await items_repository.get_list_sorted_paginated(
+                session, page=0, page_size=5, sort_column_name=None, sort_order=None,
+            )
+        assert len(entries) <= 5
+
+    run_async(scenario())
@@ -0,0 +1,253 @@
+"""
+Round trips of the `BaseRepository` writes, alone and inside `unit_of_work`, and of list
+relationship loading.
+"""
+from typing import List
+
+import pytest
+from sqlalchemy.exc import InvalidRequestError
+
+from db import AsyncSessionLocal, QueryCounter
+from api.repositories import items_repository
+from api.repositories.base import unit_of_work
+from api.utils import generate_ping_id
+from tests.conftest import run_async
+from tests.models import children_repository, parents_repository
+
+
+def statements_of(counter: QueryCounter) -> List[str]:
+    """
+    Statements reduced to their kind, e.g. "INSERT RETURNING", "SELECT", "COMMIT".
+    """
+    kinds = []
+    for statement in counter.statements:
+        kind = statement.split(None, 1)[0].upper()
+        if kind in ("INSERT", "UPDATE", "DELETE") and " RETURNING " in statement.upper():
+            kind += " RETURNING"
+        kinds.append(kind)
+    return kinds
+
+
+async def create_entry(session):
+    return await items_repository.create(session, item_id=generate_ping_id(), title="title")
+
+
+def test_create():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            with QueryCounter() as counter:
+                entry = await create_entry(session)
+        assert entry.title == "title"
+        assert statements_of(counter) == ["INSERT RETURNING", "COMMIT"]
+
+    run_async(scenario())
+
+
+def test_update():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            entry = await create_entry(session)
+            with QueryCounter() as counter:
+                updated = await items_repository.update(session, entry.id, title="updated")
+        assert updated.title == "updated"
+        assert statements_of(counter) == ["UPDATE RETURNING", "COMMIT"]
+
+    run_async(scenario())
+
+
+def test_delete():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            entry = await create_entry(session)
+            with QueryCounter() as counter:
+                await items_repository.delete(session, entry.id)
+        assert statements_of(counter) == ["DELETE", "COMMIT"]
+
+    run_async(scenario())
+
+
+def test_create_with_related():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            with QueryCounter() as counter:
+                entry = await items_repository.create_with_related(
+                    session, item_id=generate_ping_id(), title="title",
+                )
+        assert entry.title == "title"
+        # No relationships to load, no follow-up query.
+        assert statements_of(counter) == ["INSERT RETURNING", "COMMIT"]
+
+    run_async(scenario())
+
+
+def test_create_with_related_loads_only_the_relationships():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            parent = await parents_repository.create(session, name="parent")
+            with QueryCounter() as counter:
+                child = await children_repository.create_with_related(
+                    session, "parent", parent_id=parent.id, name="child",
+                )
+        assert child.parent.name == "parent"
+        # The many-to-one is joined to the only follow-up query.
+        assert statements_of(counter) == ["INSERT RETURNING", "COMMIT", "SELECT"]
+
+    run_async(scenario())
+
+
+def test_update_with_related():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            entry = await create_entry(session)
+            with QueryCounter() as counter:
+                updated = await items_repository.update_with_related(session, entry.id, title="updated")
+        assert updated.title == "updated"
+        assert statements_of(counter) == ["UPDATE RETURNING", "COMMIT"]
+
+    run_async(scenario())
+
+
+def test_update_with_related_loads_only_the_relationships():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            parent = await parents_repository.create(session, name="parent")
+            await children_repository.create(session, parent_id=parent.id, name="child")
+            with QueryCounter() as counter:
+                updated = await parents_repository.update_with_related(
+                    session, parent.id, "children", name="updated",
+                )
+        assert updated.name == "updated"
+        assert [child.name for child in updated.children] == ["child"]
+        # The entry, then its children in a "selectin" query.
+        assert statements_of(counter) == ["UPDATE RETURNING", "COMMIT", "SELECT", "SELECT"]
+
+    run_async(scenario())
+
+
+def test_unit_of_work_commits_once():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            with QueryCounter() as counter:
+                async with unit_of_work(session):
+                    entry = await create_entry(session)
+                    await items_repository.update(session, entry.id, title="updated")
+                    related = await items_repository.create_with_related(
+                        session, item_id=generate_ping_id(), title="title",
+                    )
+                    await items_repository.update_with_related(session, related.id, title="updated")
+                    await items_repository.delete(session, entry.id)
+        assert statements_of(counter) == [
+            "INSERT RETURNING",
+            "UPDATE RETURNING",
+            "INSERT RETURNING",
+            "UPDATE RETURNING",
+            "DELETE",
+            "COMMIT",
+        ]
+
+    run_async(scenario())
+
+
+def test_unit_of_work_rolls_back():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            with QueryCounter() as counter:
+                try:
+                    async with unit_of_work(session):
+                        pk = (await create_entry(session)).id
+                        raise ValueError("abort")
+                except ValueError:
+                    pass
+            assert await items_repository.get(session, pk) is None
+        assert statements_of(counter) == ["INSERT RETURNING", "ROLLBACK"]
+
+    run_async(scenario())
+
+
+def test_enrich_items():
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            item_ids = [(await create_entry(session)).item_id for _ in range(3)]
+            with QueryCounter() as counter:
+                async with unit_of_work(session):
+                    await items_repository.enrich_items(session, item_ids)
+            # One SELECT and one executemany UPDATE for the whole batch.
+            assert statements_of(counter) == ["SELECT", "UPDATE", "COMMIT"]
+            entries = await items_repository.get_list(
+                session, items_repository.query().filter("item_id", "in", item_ids),
+            )
+        assert sorted(entry.price for entry in entries) == [0, 0, 0]
+
+    run_async(scenario())
+
+
+# Relationship loading of lists: a constant number of queries whatever the number of
+# parents, at any depth of the relationship paths.
+# Parent -> children -> children -> children -> children
+DEPTH = 4
+PATHS = [".".join(["children"] * depth) for depth in range(1, DEPTH + 1)]
+
+
+async def create_parents(session, count: int) -> list:
+    """
+    `count` parents, each with two chains of `DEPTH` nested children.
+    """
+    parent_ids = []
+    for number in range(count):
+        parent = await parents_repository.create(session, name=f"parent {number}")
+        parent_ids.append(parent.id)
+        for chain in range(2):
+            child = await children_repository.create(session, parent_id=parent.id, name=f"{number}.{chain}")
+            for depth in range(1, DEPTH):
+                child = await children_repository.create(session, child_of_id=child.id, name=f"{number}.{chain}.{depth}")
+    return parent_ids
+
+
+async def load_parents(count: int, loaders: dict):
+    async with AsyncSessionLocal() as session:
+        parent_ids = await create_parents(session, count)
+    async with AsyncSessionLocal() as session:
+        with QueryCounter() as counter:
+            parents = await parents_repository.get_list_with_related(
+                session, loaders=loaders, query=parents_repository.query().filter("id", "in", parent_ids),
+            )
+    assert len(parents) == count
+    return parents, len(counter.statements)
+
+
+def leaves_of(parent) -> list:
+    entries = parent.children
+    for _ in range(DEPTH - 1):
+        entries = [child for entry in entries for child in entry.children]
+    return entries
+
+
+@pytest.mark.parametrize("strategy", ["selectin", "subquery"])
+def test_constant_queries_at_any_depth(strategy):
+    loaders = {path: strategy for path in PATHS}
+
+    async def scenario():
+        few, few_statements = await load_parents(2, loaders)
+        many, many_statements = await load_parents(6, loaders)
+        # The parents, then a query per path.
+        assert few_statements == many_statements == 1 + DEPTH
+        # Loaded already, no lazy query (it would fail outside of the session greenlet).
+        for parent in few + many:
+            assert len(leaves_of(parent)) == 2
+
+    run_async(scenario())
+
+
+def test_raise_below_the_loaded_paths():
+    loaders = {**{path: "selectin" for path in PATHS[:-1]}, PATHS[-1]: "raise"}
+
+    async def scenario():
+        few, few_statements = await load_parents(2, loaders)
+        many, many_statements = await load_parents(6, loaders)
+        assert few_statements == many_statements == DEPTH
+        deepest_loaded = [entry for child in many[0].children for entry in child.children]
+        deepest_loaded = [entry for child in deepest_loaded for entry in child.children]
+        with pytest.raises(InvalidRequestError, match="lazy='raise'"):
+            deepest_loaded[0].children
+
+    run_async(scenario())
@@ -0,0 +1,126 @@
+"""
+Read routing between the primary and two replicas. The replicas are separate SQLite
+databases, each with a marker entry of its own title, so a read tells where it went.
+"""
+import os
+import tempfile
+import uuid
+
+import pytest
+from sqlalchemy import delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+import db
+from api.models import Items
+from api.models.base import metadata
+from api.repositories import items_repository
+from api.utils import generate_ping_id
+from tests.conftest import run_async
+
+MARKER = "routing-marker"
+
+
+@pytest.fixture
+def routing(monkeypatch):
+    """
+    Session factory routing between the test database and two replicas, and the replica
+    engines, to be disposed by the test on its event loop.
+    """
+    directory = tempfile.mkdtemp(prefix="fastapi-replicas-")
+    urls = [f"sqlite+aiosqlite:///{os.path.join(directory, f'replica-{index}.db')}" for index in range(2)]
+
+    async def create_databases():
+        for url in urls:
+            engine = create_async_engine(url)
+            async with engine.begin() as connection:
+                await connection.run_sync(metadata.create_all)
+            await engine.dispose()
+        await insert_marker(db.async_engine, "primary")
+        for index, url in enumerate(urls):
+            engine = create_async_engine(url)
+            await insert_marker(engine, f"replica {index}")
+            await engine.dispose()
+
+    run_async(create_databases())
+    engines = [create_async_engine(url) for url in urls]
+    monkeypatch.setattr(db, "replicas", db.ReplicaSet(engines, policy="round_robin"))
+    yield async_sessionmaker(
+        bind=db.async_engine, class_=AsyncSession, expire_on_commit=False, sync_session_class=db.RoutingSession,
+    ), engines
+
+    async def delete_marker():
+        async with db.async_engine.begin() as connection:
+            await connection.execute(delete(Items).where(Items.item_id == MARKER))
+    run_async(delete_marker())
+
+
+async def insert_marker(engine, title: str) -> None:
+    async with engine.begin() as connection:
+        await connection.execute(insert(Items).values(id=uuid.uuid4(), item_id=MARKER, title=title))
+
+
+async def read_marker(session) -> str:
+    """
+    Title of the marker of the database the read went to.
+    """
+    entries = await items_repository.get_list(session, items_repository.query().filter("item_id", "eq", MARKER))
+    return entries[0].title
+
+
+def test_reads_stick_to_a_replica_per_transaction_and_alternate(routing):
+    session_factory, engines = routing
+
+    async def scenario():
+        titles = []
+        for _ in range(2):
+            async with session_factory() as session:
+                first = await read_marker(session)
+                # Same transaction, same replica.
+                assert await read_marker(session) == first
+                await session.commit()
+                titles.append(first)
+        # Round robin, the next transaction reads the other replica.
+        assert sorted(titles) == ["replica 0", "replica 1"]
+        for engine in engines:
+            await engine.dispose()
+
+    run_async(scenario())
+
+
+def test_writes_and_reads_of_own_writes_go_to_the_primary(routing):
+    session_factory, engines = routing
+
+    async def scenario():
+        async with session_factory() as session:
+            entry = await items_repository.create(session, item_id=generate_ping_id(), title="written")
+            assert await read_marker(session) == "primary"
+        async with db.AsyncSessionLocal() as session:
+            assert (await items_repository.get(session, entry.id)).title == "written"
+        for engine in engines:
+            await engine.dispose()
+
+    run_async(scenario())
+
+
+def test_unreachable_replica_falls_back_to_the_primary(monkeypatch):
+    unreachable = create_async_engine("sqlite+aiosqlite:////non-existing-directory/replica.db")
+    monkeypatch.setattr(db, "replicas", db.ReplicaSet([unreachable]))
+    session_factory = async_sessionmaker(
+        bind=db.async_engine, class_=AsyncSession, expire_on_commit=False, sync_session_class=db.RoutingSession,
+    )
+
+    async def scenario():
+        await insert_marker(db.async_engine, "primary")
+        try:
+            async with session_factory() as session:
+                assert await read_marker(session) == "primary"
+            assert not db.replicas.is_healthy(unreachable.sync_engine)
+            # Skipped until `retry_sec` passed, straight to the primary.
+            async with session_factory() as session:
+                assert await read_marker(session) == "primary"
+        finally:
+            async with db.async_engine.begin() as connection:
+                await connection.execute(delete(Items).where(Items.item_id == MARKER))
+            await unreachable.dispose()
+
+    run_async(scenario())